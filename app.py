@@ -1,11 +1,46 @@
+import os
+import re
+import sys
+import gzip
 import json
+import math
 import time
+import zlib
 import uuid
+import queue
+import random
+import select
+import socket
+import struct
 import argparse
-from flask import Flask, request, Response, jsonify, render_template
+import threading
+import functools
+import http.cookiejar
+import contextlib
+from collections import Counter, deque, namedtuple
+from json.encoder import encode_basestring, encode_basestring_ascii
+from flask import Flask, request, Response, jsonify, render_template, g
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 用于按 pattern 生成示例字符串，Python 3.11 起 sre_parse 移入 re._parser
+try:
+    import re._parser as regex_parser
+except ImportError:
+    import sre_parse as regex_parser
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,6 +49,34 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # 添加CORS支持
 
+# 上游请求共用的连接池，流被取消时关闭响应即可把连接槽位归还给连接池
+UPSTREAM_POOL_SIZE = 64
+upstream_session = requests.Session()
+upstream_session.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=UPSTREAM_POOL_SIZE))
+upstream_session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=UPSTREAM_POOL_SIZE))
+# 只复用连接，不保存上游的 Set-Cookie，避免把某个请求得到的 cookie 带到其他客户端和租户的请求中
+upstream_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+# 请求体大小默认上限，可通过 config.json 的 max_body_bytes 覆盖
+DEFAULT_MAX_BODY_BYTES = 32 * 1024 * 1024
+# 超过该大小的请求体在日志中只记录摘要
+MAX_LOGGED_BODY = 64 * 1024
+# 代理模式下超过该大小（或长度未知）的请求体直接流式转发给上游，可通过 proxy_config.stream_body_threshold 覆盖
+DEFAULT_STREAM_BODY_THRESHOLD = 1024 * 1024
+# mock 模式匹配与生成响应用到的请求字段，其余字段解析后即丢弃
+MOCK_REQUEST_FIELDS = (
+    'model', 'messages', 'stream', 'user', 'tools', 'tool_choice', 'functions', 'function_call',
+    'max_tokens', 'parallel_tool_calls', 'seed'
+)
+
+# 流式响应中检查客户端是否断开的最小间隔（秒）
+DISCONNECT_CHECK_INTERVAL = 0.05
+
+# 性能分析开关，默认关闭，通过 --enable-profiling 启动参数开启
+PROFILING_ENABLED = False
+_NULL_PHASE = contextlib.nullcontext()
+_sampling_lock = threading.Lock()
+
 
 def read_config():
     """读取并解析config.json文件"""
@@ -23,8 +86,305 @@ def read_config():
 
 def write_config(config):
     """保存配置到config.json文件"""
+    global _config_snapshot
     with open('config.json', 'w', encoding='utf-8') as f:
         json.dump(config, f, indent=2, ensure_ascii=False)
+    _config_snapshot = None
+
+
+DEFAULT_CONTENT = 'This is a simulated response from the mock OpenAI API.'
+
+# 响应压缩默认配置，可通过 config.json 的 compression 字段覆盖
+DEFAULT_COMPRESSION = {
+    'enabled': True,
+    'min_size': 1024,
+    'stream': False,
+    'levels': {'zstd': 3, 'br': 5, 'gzip': 6}
+}
+
+# 按服务端优先级排列的可用压缩算法
+COMPRESSION_ENCODINGS = [
+    encoding for encoding, available in (('zstd', zstandard), ('br', brotli), ('gzip', gzip))
+    if available is not None
+]
+
+
+class ConfigSnapshot:
+    """配置快照
+
+    保存解析后的配置以及加载时预先计算好的数据，
+    例如预设非流式响应的序列化结果和各算法的压缩结果。
+    """
+
+    def __init__(self, config, key=None, tenant=None):
+        self.config = config
+        self.key = key
+        self.tenant = tenant
+        self.max_body_bytes = int(config.get('max_body_bytes', DEFAULT_MAX_BODY_BYTES))
+        compression = dict(DEFAULT_COMPRESSION)
+        compression.update(config.get('compression', {}))
+        compression['levels'] = {**DEFAULT_COMPRESSION['levels'], **compression.get('levels', {})}
+        self.compression = compression
+        # 以预设对象 id 为键，快照持有预设对象的引用，因此 id 在快照生命周期内稳定
+        # 不含模板占位符的非流式响应预先序列化并压缩，含占位符的编译为渲染函数
+        self.preset_bodies = {}
+        self.preset_templates = {}
+        self.preset_streams = {}
+        for preset in config.get('preset_responses', []):
+            if preset.get('response'):
+                body = json.dumps(preset['response'], ensure_ascii=False)
+                render = compile_template(body, 'json')
+                if render is None:
+                    self.preset_bodies[id(preset)] = PrecompressedBody(body.encode('utf-8'), compression)
+                else:
+                    self.preset_templates[id(preset)] = render
+            if preset.get('stream_response_chunks'):
+                self.preset_streams[id(preset)] = compile_stream_chunks(preset['stream_response_chunks'])
+        # 默认响应内容的渲染函数，不含占位符时为 None
+        self.default_content_render = compile_template(
+            config.get('mock_config', {}).get('default_content', DEFAULT_CONTENT))
+
+        synthetic = config.get('mock_config', {}).get('synthetic', {})
+        self.synthetic = SyntheticText(synthetic) if synthetic.get('enabled', False) else None
+
+        # 故障注入配置，加载时编译为 FaultProfile，每个配置拥有独立的带种子随机数生成器
+        self.default_faults = None
+        self.model_faults = {}
+        self.preset_faults = {}
+        fault_injection = config.get('mock_config', {}).get('fault_injection', {})
+        if fault_injection.get('enabled', False):
+            seed = fault_injection.get('seed', 0)
+            if fault_injection.get('default'):
+                self.default_faults = FaultProfile('default', fault_injection['default'], seed)
+            for model, options in fault_injection.get('models', {}).items():
+                self.model_faults[model] = FaultProfile(f'model:{model}', options, seed)
+            for index, preset in enumerate(config.get('preset_responses', [])):
+                if preset.get('fault_profile'):
+                    self.preset_faults[id(preset)] = FaultProfile(f'preset:{index}', preset['fault_profile'], seed)
+
+        # 多租户配置，每个租户加载时编译为独立快照，按租户名或 API key 直接查表
+        self.tenants = {}
+        self.tenant_keys = {}
+        for name, tenant_config in (config.get('tenants') or {}).items():
+            self.tenants[name] = ConfigSnapshot(merge_tenant_config(config, tenant_config), key, name)
+            for api_key in tenant_config.get('api_keys', []):
+                self.tenant_keys[api_key] = name
+
+    def select_tenant(self, name=None, api_key=None):
+        """按租户名（优先）或 API key 选择租户快照，都未指定或 key 未绑定租户时返回自身，租户名不存在时返回 None"""
+        if name:
+            return self.tenants.get(name)
+        tenant = self.tenant_keys.get(api_key)
+        return self if tenant is None else self.tenants[tenant]
+
+    def fault_profile(self, request_data, preset=None):
+        """按 预设 > 模型 > 默认 的优先级选择故障注入配置"""
+        if preset is not None and id(preset) in self.preset_faults:
+            return self.preset_faults[id(preset)]
+        return self.model_faults.get(request_data.get('model'), self.default_faults)
+
+
+# 租户配置中按字段合并到顶层配置的配置段，其余字段（mode、preset_responses 等）整体覆盖
+TENANT_MERGED_SECTIONS = ('mock_config', 'proxy_config', 'compression', 'capture')
+
+
+def merge_tenant_config(config, tenant_config):
+    """以顶层配置为基础合并租户配置"""
+    merged = {key: value for key, value in config.items() if key != 'tenants'}
+    for key, value in tenant_config.items():
+        if key == 'api_keys':
+            continue
+        if key in TENANT_MERGED_SECTIONS and isinstance(value, dict):
+            merged[key] = {**config.get(key, {}), **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+_config_snapshot = None
+_config_lock = threading.Lock()
+
+
+def load_config():
+    """获取配置快照，config.json 被修改后自动重新加载"""
+    global _config_snapshot
+    stat = os.stat('config.json')
+    key = (stat.st_mtime_ns, stat.st_size)
+    snapshot = _config_snapshot
+    if snapshot is not None and snapshot.key == key:
+        return snapshot
+    with _config_lock:
+        if _config_snapshot is None or _config_snapshot.key != key:
+            _config_snapshot = ConfigSnapshot(read_config(), key)
+            logger.info("[CONFIG] Loaded config.json")
+        return _config_snapshot
+
+
+# 显式指定租户的请求头，优先于 Authorization 中的 API key
+TENANT_HEADER = 'X-Mock-Tenant'
+
+
+def request_snapshot():
+    """按请求头选择当前请求使用的租户快照，指定的租户不存在时返回 None"""
+    snapshot = load_config()
+    if not snapshot.tenants:
+        return snapshot
+    auth = request.headers.get('Authorization', '')
+    api_key = auth[7:].strip() if auth.startswith('Bearer ') else None
+    return snapshot.select_tenant(request.headers.get(TENANT_HEADER), api_key)
+
+
+def current_snapshot():
+    """当前请求使用的配置快照"""
+    snapshot = g.get('config_snapshot')
+    if snapshot is None:
+        snapshot = g.config_snapshot = load_config()
+    return snapshot
+
+
+def compress_data(data, encoding, levels):
+    """一次性压缩完整响应体"""
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=levels['zstd']).compress(data)
+    if encoding == 'br':
+        return brotli.compress(data, quality=levels['br'])
+    return gzip.compress(data, compresslevel=levels['gzip'])
+
+
+def negotiate_encoding(accept_encoding):
+    """根据 Accept-Encoding 选择压缩算法，q 值相同时按服务端优先级选择"""
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in COMPRESSION_ENCODINGS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class PrecompressedBody:
+    """预先按所有可用算法压缩好的 JSON 响应体"""
+
+    def __init__(self, data, compression):
+        self.data = data
+        self.encoded = {}
+        if compression['enabled'] and len(self.data) >= compression['min_size']:
+            for encoding in COMPRESSION_ENCODINGS:
+                self.encoded[encoding] = compress_data(self.data, encoding, compression['levels'])
+
+
+def json_body_response(data, status=200, encoded=None):
+    """返回 JSON 响应体，超过阈值时按 Accept-Encoding 协商压缩
+
+    encoded 为预先压缩好的结果（算法 -> 字节），命中时不再消耗压缩 CPU。
+    """
+    compression = current_snapshot().compression
+    response = Response(data, status=status, mimetype='application/json')
+    if compression['enabled'] and len(data) >= compression['min_size']:
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding:
+            body = encoded.get(encoding) if encoded else None
+            if body is None:
+                body = compress_data(data, encoding, compression['levels'])
+            response.set_data(body)
+            response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def stream_compressor(encoding, levels):
+    """创建流式压缩器，返回 (压缩并刷新单帧, 结束) 两个函数
+
+    每帧之后都做同步刷新，保证客户端能及时解出完整的 SSE 事件。
+    """
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=levels['zstd']).compressobj()
+        return (lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+                compressor.flush)
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=levels['br'])
+        return lambda data: compressor.process(data) + compressor.flush(), compressor.finish
+    compressor = zlib.compressobj(levels['gzip'], zlib.DEFLATED, 31)
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def compress_stream(frames, encoding, levels):
+    """流式压缩 SSE 输出"""
+    compress_frame, finish = stream_compressor(encoding, levels)
+    try:
+        for frame in frames:
+            if isinstance(frame, str):
+                frame = frame.encode('utf-8')
+            yield compress_frame(frame)
+        yield finish()
+    finally:
+        frames.close()
+
+
+def client_disconnected(sock):
+    """检查客户端是否已断开：socket 可读但读不到数据说明对端已关闭连接"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+def guard_stream(frames, environ, tenant_stats):
+    """客户端断开后立即停止生成流式响应
+
+    开发服务器提供底层 socket 时，每隔 DISCONNECT_CHECK_INTERVAL 检查一次连接状态；
+    服务器写入失败关闭响应时同样会走到这里的清理逻辑。关闭 frames 会依次触发
+    各层生成器的清理（例如关闭上游响应），被取消的流计入 tenant_stats。
+    """
+    sock = environ.get('werkzeug.socket')
+    last_check = time.monotonic()
+    completed = False
+    tenant_stats.incr('streams', 'started')
+    try:
+        for frame in frames:
+            if sock is not None:
+                now = time.monotonic()
+                if now - last_check >= DISCONNECT_CHECK_INTERVAL:
+                    last_check = now
+                    if client_disconnected(sock):
+                        logger.info("[STREAM] Client disconnected, cancelling stream")
+                        return
+            yield frame
+        completed = True
+    finally:
+        frames.close()
+        tenant_stats.incr('streams', 'completed' if completed else 'cancelled')
+
+
+def sse_response(frames):
+    """返回 SSE 流式响应，开启流式压缩时按 Accept-Encoding 协商压缩"""
+    frames = guard_stream(frames, request.environ, request_state().stats)
+    compression = current_snapshot().compression
+    if compression['enabled'] and compression['stream']:
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding:
+            response = Response(compress_stream(frames, encoding, compression['levels']),
+                                mimetype='text/event-stream')
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    return Response(frames, mimetype='text/event-stream')
 
 
 @app.route('/')
@@ -59,61 +419,607 @@ def save_config():
         return jsonify({'error': str(e)}), 500
 
 
-def get_proxy_config():
+def get_proxy_config(config=None):
     """获取代理配置"""
-    config = read_config()
+    if config is None:
+        config = read_config()
     return config.get('proxy_config', {})
 
 
-def get_mode():
+def get_mode(config=None):
     """获取当前模式"""
-    config = read_config()
+    if config is None:
+        config = read_config()
     return config.get('mode', 'mock')
 
 
-def forward_request(request_data, proxy_config):
-    """转发请求到第三方 API"""
+class RequestProfile:
+    """单个请求的耗时分析，按阶段累计墙钟时间"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def server_timing(self):
+        """转换为 Server-Timing 响应头"""
+        return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.phases.items())
+
+    def summary(self):
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()}
+        }
+
+
+def start_request_profile():
+    """请求头 X-Mock-Profile 或查询参数 profile 存在时，为当前请求开启耗时分析"""
+    if not PROFILING_ENABLED:
+        return None
+    if request.headers.get('X-Mock-Profile') or request.args.get('profile'):
+        g.mock_profile = RequestProfile()
+        return g.mock_profile
+    return None
+
+
+def profile_phase(name):
+    """统计当前请求某个阶段的耗时，未开启分析时为空操作"""
+    if not PROFILING_ENABLED:
+        return _NULL_PHASE
+    profile = g.get('mock_profile')
+    if profile is None:
+        return _NULL_PHASE
+    return profile.phase(name)
+
+
+def finish_request_profile(profile, rv):
+    """序列化响应并附加分析结果：非流式响应写入 Server-Timing，流式响应在结束时追加注释帧
+
+    流式压缩的响应在压缩流结束后无法再追加明文帧，只写入 Server-Timing 和日志。
+    """
+    with profile.phase('serialize'):
+        response = app.make_response(rv)
+    response.headers['Server-Timing'] = profile.server_timing()
+    if response.is_streamed:
+        response.response = profile_stream(response.response, profile, 'Content-Encoding' not in response.headers)
+    else:
+        logger.info(f"[PROFILE] {json.dumps(profile.summary())}")
+    return response
+
+
+def profile_stream(frames, profile, trailer=True):
+    """统计流式输出耗时，trailer 为真时在结束时以 SSE 注释行输出分析结果"""
+    try:
+        with profile.phase('stream'):
+            yield from frames
+        if trailer:
+            yield f': profile {json.dumps(profile.summary())}\n\n'
+    finally:
+        logger.info(f"[PROFILE] {json.dumps(profile.summary())}")
+
+
+def sample_stacks(seconds, interval, per_thread=False):
+    """定时采样所有工作线程的调用栈，返回折叠栈（collapsed stacks）计数
+
+    开发服务器为每个请求创建新线程，默认不带线程名，使相同的调用栈合并；
+    per_thread 为真时以线程名作为栈的根节点。
+    """
+    own_ident = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()} if per_thread else None
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if per_thread:
+                frames.append(thread_names.get(ident, str(ident)))
+            stacks[';'.join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+@app.route('/api/profile/sample', methods=['GET', 'POST'])
+def profile_sample():
+    """采样分析 N 秒，返回可用于生成火焰图的折叠栈，per_thread=1 时按线程分开"""
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'profiling is disabled, start the server with --enable-profiling'}), 404
+    try:
+        seconds = min(float(request.args.get('seconds', 5)), 60.0)
+        interval = max(float(request.args.get('interval_ms', 5)), 1.0) / 1000
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not _sampling_lock.acquire(blocking=False):
+        return jsonify({'error': 'a sampling session is already running'}), 409
+    try:
+        stacks = sample_stacks(seconds, interval, request.args.get('per_thread') in ('1', 'true'))
+    finally:
+        _sampling_lock.release()
+    body = ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+    return Response(body, mimetype='text/plain')
+
+
+class Stats:
+    """线程安全的分组计数统计，以及按名称记录的最近延迟样本"""
+
+    LATENCY_WINDOW = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._latencies = {}
+
+    def incr(self, group, name, amount=1):
+        with self._lock:
+            counters = self._groups.setdefault(group, Counter())
+            counters[name] += amount
+
+    def observe(self, name, seconds):
+        """记录一次延迟样本，只保留最近 LATENCY_WINDOW 个用于计算分位数"""
+        with self._lock:
+            latency = self._latencies.get(name)
+            if latency is None:
+                latency = self._latencies[name] = [0, deque(maxlen=self.LATENCY_WINDOW)]
+            latency[0] += 1
+            latency[1].append(seconds)
+
+    @staticmethod
+    def summarize(count, samples):
+        ordered = sorted(samples)
+        if not ordered:
+            return {'count': count}
+
+        def percentile(p):
+            return round(ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] * 1000, 2)
+
+        return {
+            'count': count,
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+            'p50_ms': percentile(50),
+            'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+            'max_ms': round(ordered[-1] * 1000, 2)
+        }
+
+    def snapshot(self):
+        with self._lock:
+            result = {group: dict(counters) for group, counters in self._groups.items()}
+            latencies = {name: (count, list(samples)) for name, (count, samples) in self._latencies.items()}
+        if latencies:
+            result['latency'] = {name: self.summarize(count, samples)
+                                 for name, (count, samples) in sorted(latencies.items())}
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._groups.clear()
+            self._latencies.clear()
+
+
+stats = Stats()
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """获取运行统计（请求数、注入的故障数、延迟分位数等），?tenant= 指定租户时返回该租户的统计"""
+    state = _tenant_states.get(request.args.get('tenant') or None)
+    snapshot = state.stats.snapshot() if state is not None else {}
+    hedge = snapshot.get('hedge')
+    if hedge and hedge.get('requests'):
+        hedge['hedge_rate'] = round(hedge.get('hedged', 0) / hedge['requests'], 4)
+    return jsonify(snapshot)
+
+
+@app.route('/api/stats', methods=['DELETE'])
+def reset_stats():
+    """清空运行统计，?tenant= 指定租户时只清空该租户的统计"""
+    tenant = request.args.get('tenant')
+    for name, state in list(_tenant_states.items()):
+        if not tenant or name == tenant:
+            state.stats.reset()
+    return jsonify({'status': 'success'})
+
+
+# 单次请求的故障注入计划，各 *_at 字段为触发故障的流式分块序号（从 1 开始），None 表示不触发
+FaultPlan = namedtuple('FaultPlan', [
+    'error_status', 'reset', 'ttfb_seconds', 'truncate_at', 'stall_at', 'stall_seconds', 'malformed_at', 'reset_at'
+])
+
+FAULT_ERROR_TYPES = {
+    429: ('Rate limit reached for requests', 'rate_limit_error'),
+    500: ('The server had an error while processing your request', 'server_error'),
+    503: ('The server is overloaded or not ready yet', 'service_unavailable')
+}
+
+
+class FaultProfile:
+    """故障注入配置
+
+    支持的字段：
+    - error_rate: 状态码到概率的映射，例如 {"429": 0.05, "500": 0.01, "503": 0.02}
+    - reset_rate: 连接被重置的概率（流式请求在中途重置）
+    - slow_ttfb_rate / ttfb_seconds: 首字节延迟的概率与时长
+    - truncate_rate: 流式响应中途截断（不发送 [DONE]）的概率
+    - stall_rate / stall_seconds: 流式响应中途停顿的概率与时长
+    - malformed_rate: 流式响应中插入非法 SSE 分块的概率
+    - fault_window: 流式故障在前多少个分块内随机触发，默认 20
+
+    每次请求固定抽取相同数量的随机数，因此相同种子和相同请求顺序下注入结果完全一致。
+    """
+
+    def __init__(self, name, options, seed=0):
+        self.name = name
+        self.error_rates = [(int(status), float(rate)) for status, rate in options.get('error_rate', {}).items()]
+        self.reset_rate = float(options.get('reset_rate', 0))
+        self.slow_ttfb_rate = float(options.get('slow_ttfb_rate', 0))
+        self.ttfb_seconds = float(options.get('ttfb_seconds', 5))
+        self.truncate_rate = float(options.get('truncate_rate', 0))
+        self.stall_rate = float(options.get('stall_rate', 0))
+        self.stall_seconds = float(options.get('stall_seconds', 10))
+        self.malformed_rate = float(options.get('malformed_rate', 0))
+        self.window = max(int(options.get('fault_window', 20)), 1)
+        self._random = random.Random(f"{options.get('seed', seed)}:{name}")
+        self._lock = threading.Lock()
+
+    def plan(self, stream):
+        """为一次请求抽取故障注入计划"""
+        with self._lock:
+            draw = self._random.random
+            error_draw, reset_draw, ttfb_draw, truncate_draw, stall_draw, malformed_draw = (draw() for _ in range(6))
+            positions = [self._random.randint(1, self.window) for _ in range(4)]
+
+        error_status = None
+        cumulative = 0.0
+        for status, rate in self.error_rates:
+            cumulative += rate
+            if error_draw < cumulative:
+                error_status = status
+                break
+
+        reset = reset_draw < self.reset_rate
+        return FaultPlan(
+            error_status=error_status,
+            reset=reset and not stream,
+            ttfb_seconds=self.ttfb_seconds if ttfb_draw < self.slow_ttfb_rate else 0,
+            truncate_at=positions[0] if stream and truncate_draw < self.truncate_rate else None,
+            stall_at=positions[1] if stream and stall_draw < self.stall_rate else None,
+            stall_seconds=self.stall_seconds,
+            malformed_at=positions[2] if stream and malformed_draw < self.malformed_rate else None,
+            reset_at=positions[3] if stream and reset else None
+        )
+
+
+def reset_connection(environ):
+    """立即断开客户端连接
+
+    开发服务器提供底层 socket 时设置 SO_LINGER=0 并关闭读写，服务器随后的写入会按客户端断开处理；
+    其他服务器抛出 ConnectionResetError 由服务器中断连接。
+    """
+    sock = environ.get('werkzeug.socket')
+    if sock is None:
+        raise ConnectionResetError('connection reset by fault injection')
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    sock.shutdown(socket.SHUT_RDWR)
+
+
+def reset_stream(environ):
+    """在发送任何数据之前重置连接"""
+    reset_connection(environ)
+    yield b''
+
+
+def apply_request_faults(faults):
+    """注入请求级故障（首字节延迟、错误状态码、连接重置），需要提前返回时返回响应"""
+    tenant_stats = request_state().stats
+    if faults.ttfb_seconds:
+        tenant_stats.incr('faults', 'slow_ttfb')
+        time.sleep(faults.ttfb_seconds)
+
+    if faults.reset:
+        tenant_stats.incr('faults', 'reset')
+        logger.info("[FAULT] Resetting connection")
+        return Response(reset_stream(request.environ))
+
+    if faults.error_status:
+        tenant_stats.incr('faults', f'error_{faults.error_status}')
+        logger.info(f"[FAULT] Returning HTTP {faults.error_status}")
+        message, error_type = FAULT_ERROR_TYPES.get(faults.error_status, ('Injected error', 'server_error'))
+        response = jsonify({'error': {'message': message, 'type': error_type}})
+        response.status_code = faults.error_status
+        if faults.error_status in (429, 503):
+            response.headers['Retry-After'] = '1'
+        return response
+
+    return None
+
+
+def inject_stream_faults(frames, faults, environ, tenant_stats):
+    """在流式响应中注入停顿、非法分块、截断和连接重置"""
+    try:
+        for index, frame in enumerate(frames, 1):
+            if index == faults.stall_at:
+                tenant_stats.incr('faults', 'stall')
+                time.sleep(faults.stall_seconds)
+            if index == faults.malformed_at:
+                tenant_stats.incr('faults', 'malformed')
+                yield b'data: {"id": "chatcmpl-malformed", "choices": [{"delta": {"content": \n\n'
+            if index == faults.truncate_at:
+                tenant_stats.incr('faults', 'truncate')
+                return
+            if index == faults.reset_at:
+                tenant_stats.incr('faults', 'reset')
+                reset_connection(environ)
+                return
+            yield frame
+    finally:
+        frames.close()
+
+
+class StreamedRequestBody:
+    """以文件对象的形式把客户端请求体交给 requests，边读边发给上游，并保留 Content-Length"""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def iter_json_body(request_data, chunk_size=65536):
+    """增量序列化 JSON 请求体并按块输出，避免在内存中生成完整的序列化副本"""
+    pending = []
+    pending_size = 0
+    for piece in json.JSONEncoder(ensure_ascii=False).iterencode(request_data):
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= chunk_size:
+            yield ''.join(pending).encode('utf-8')
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+
+# 代理模式下客户端原本请求的流式选项，请求体未解析（直接透传）时为 None
+ClientStream = namedtuple('ClientStream', ['stream', 'include_usage'])
+
+
+def read_proxy_body(proxy_config, keep_body=False):
+    """准备转发给上游的请求体，返回 (请求体, 便于记录/抓包的内存副本或 None, ClientStream 或 None)
+
+    - 需要改写 model 或 stream 时解析 JSON，再增量序列化后以分块编码发给上游
+    - 请求体较小时读入内存，只保留这一份副本
+    - 请求体较大或长度未知时直接从客户端流式转发，不在内存中保留副本
+    keep_body 为真时（开启抓包）总是读入并保留完整请求体，大小受 max_body_bytes 限制。
+    """
+    model = proxy_config.get('model', None)
+    upstream_stream = proxy_config.get('upstream_stream')
+    if model or upstream_stream is not None:
+        body = read_request_body()
+        request_data = json.loads(body)
+        stream_options = request_data.get('stream_options') or {}
+        client_stream = ClientStream(bool(request_data.get('stream', False)),
+                                     bool(stream_options.get('include_usage', False)))
+        if model:
+            request_data['model'] = model
+        if upstream_stream is not None:
+            rewrite_upstream_stream(request_data, bool(upstream_stream), client_stream)
+        upstream_body = iter_json_body(request_data)
+        if (proxy_config.get('hedge') or {}).get('enabled', False):
+            # 对冲请求需要能重复发送请求体
+            upstream_body = b''.join(upstream_body)
+        return upstream_body, body if keep_body or len(body) <= MAX_LOGGED_BODY else None, client_stream
+
+    length = request.content_length
+    threshold = proxy_config.get('stream_body_threshold', DEFAULT_STREAM_BODY_THRESHOLD)
+    if keep_body or (length is not None and length <= threshold):
+        body = read_request_body()
+        return body, body if keep_body or len(body) <= MAX_LOGGED_BODY else None, None
+
+    stream = request.stream
+    if length is not None:
+        return StreamedRequestBody(stream, length), None, None
+    return iter(functools.partial(stream.read, 65536), b''), None, None
+
+
+def rewrite_upstream_stream(request_data, upstream_stream, client_stream):
+    """按 proxy_config.upstream_stream 改写发给上游的 stream 参数"""
+    request_data['stream'] = upstream_stream
+    if not upstream_stream:
+        # 上游不接受非流式请求携带 stream_options
+        request_data.pop('stream_options', None)
+    elif not client_stream.stream:
+        # 流式升级时请求上游在最后一个分块中返回 usage，以便聚合出完整响应
+        request_data['stream_options'] = {**(request_data.get('stream_options') or {}), 'include_usage': True}
+
+
+class UpstreamHedger:
+    """对冲上游请求：首个请求在延迟阈值内未返回响应头时再发送一个相同的请求，先返回者胜出
+
+    阈值为 hedge.delay_ms，配置了 delay_percentile 且样本足够时改用最近上游延迟的该分位数；
+    额外发送的请求数受 hedge.budget_per_minute 限制。
+    """
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, tenant_stats):
+        self.stats = tenant_stats
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=Stats.LATENCY_WINDOW)
+        self._budget_minute = None
+        self._budget_used = 0
+
+    def delay(self, hedge_config):
+        percentile = hedge_config.get('delay_percentile')
+        if percentile:
+            with self._lock:
+                samples = sorted(self._latencies)
+            if len(samples) >= hedge_config.get('min_samples', self.MIN_SAMPLES):
+                return samples[min(int(percentile / 100 * len(samples)), len(samples) - 1)]
+        return hedge_config.get('delay_ms', 500) / 1000
+
+    def acquire_budget(self, budget_per_minute):
+        minute = int(time.time() // 60)
+        with self._lock:
+            if minute != self._budget_minute:
+                self._budget_minute = minute
+                self._budget_used = 0
+            if self._budget_used >= budget_per_minute:
+                return False
+            self._budget_used += 1
+            return True
+
+    def post(self, send, hedge_config):
+        """通过 send() 发送上游请求（必要时发送两次），返回最先收到的响应
+
+        落败的请求在收到响应头后立即关闭；两个请求都失败时抛出先失败者的异常。
+        """
+        started = time.perf_counter()
+        results = queue.Queue()
+        winner_lock = threading.Lock()
+        winner = []
+
+        def attempt(name):
+            attempt_started = time.perf_counter()
+            try:
+                response = send()
+            except Exception as e:
+                # 任何异常都要交给调用方重新抛出，否则调用方会一直等待结果
+                results.put((name, None, e))
+                return
+            now = time.perf_counter()
+            with self._lock:
+                self._latencies.append(now - attempt_started)
+            if name == 'primary':
+                self.stats.observe('upstream.primary', now - started)
+            with winner_lock:
+                won = not winner
+                if won:
+                    winner.append(name)
+            if won:
+                results.put((name, response, None))
+            else:
+                # 落败的一方：关闭响应，把连接归还连接池
+                response.close()
+                self.stats.incr('hedge', 'cancelled')
+
+        self.stats.incr('hedge', 'requests')
+        threading.Thread(target=attempt, args=('primary',), daemon=True).start()
+        pending = 1
+        try:
+            result = results.get(timeout=self.delay(hedge_config))
+        except queue.Empty:
+            result = None
+            if self.acquire_budget(hedge_config.get('budget_per_minute', 60)):
+                logger.info("[PROXY] Upstream slow to respond, sending hedged request")
+                self.stats.incr('hedge', 'hedged')
+                threading.Thread(target=attempt, args=('hedge',), daemon=True).start()
+                pending += 1
+            else:
+                self.stats.incr('hedge', 'budget_exhausted')
+
+        first_error = None
+        while True:
+            name, response, error = result if result is not None else results.get()
+            result = None
+            if response is not None:
+                if name == 'hedge':
+                    self.stats.incr('hedge', 'hedge_wins')
+                self.stats.observe('upstream.effective', time.perf_counter() - started)
+                return response
+            first_error = first_error or error
+            pending -= 1
+            if not pending:
+                raise first_error
+
+
+hedger = UpstreamHedger(stats)
+
+
+class TenantState:
+    """租户的运行时状态：统计和对冲请求（延迟样本与预算），配置重新加载后保留"""
+
+    def __init__(self, tenant_stats=None, tenant_hedger=None):
+        self.stats = tenant_stats or Stats()
+        self.hedger = tenant_hedger or UpstreamHedger(self.stats)
+
+
+# 以租户名为键，None 为未选择租户的请求，使用全局的 stats 和 hedger
+_tenant_states = {None: TenantState(stats, hedger)}
+_tenant_states_lock = threading.Lock()
+
+
+def tenant_state(name):
+    state = _tenant_states.get(name)
+    if state is None:
+        with _tenant_states_lock:
+            state = _tenant_states.setdefault(name, TenantState())
+    return state
+
+
+def request_state():
+    """当前请求所属租户的运行时状态"""
+    return g.get('tenant_state') or _tenant_states[None]
+
+
+def forward_request(body, proxy_config, logged_body=None):
+    """转发请求到第三方 API
+
+    始终以流式方式读取上游响应，由调用方根据响应的 Content-Type 决定如何转发。
+    """
     target_url = proxy_config.get('target_url')
     api_key = proxy_config.get('api_key')
     timeout = proxy_config.get('timeout', 60)
     log_requests = proxy_config.get('log_requests', True)
-    model = proxy_config.get('model', None)
-    if model:
-        request_data['model'] = model
 
     if log_requests:
         logger.info(f"[PROXY] Forwarding request to {target_url}")
-        logger.info(f"[PROXY] Request data: {json.dumps(request_data, ensure_ascii=False)}")
+        if logged_body is not None:
+            logger.info(f"[PROXY] Request data: {logged_body.decode('utf-8', 'replace')}")
+        else:
+            logger.info(f"[PROXY] Request data: <streamed, {request.content_length or 'unknown'} bytes>")
     
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f"Bearer {api_key}"
     }
     
-    is_stream = request_data.get('stream', False)
-    
+    send = functools.partial(upstream_session.post, target_url, data=body, headers=headers, stream=True,
+                             timeout=timeout)
+    hedge_config = proxy_config.get('hedge') or {}
     try:
-        if is_stream:
-            response = requests.post(
-                target_url,
-                json=request_data,
-                headers=headers,
-                stream=True,
-                timeout=timeout
-            )
-            return response
+        if not hedge_config.get('enabled', False):
+            response = send()
+        elif isinstance(body, bytes):
+            response = request_state().hedger.post(send, hedge_config)
         else:
-            response = requests.post(
-                target_url,
-                json=request_data,
-                headers=headers,
-                timeout=timeout
-            )
-            
-            if log_requests and response.status_code == 200:
-                logger.info(f"[PROXY] Response data: {json.dumps(response.json(), ensure_ascii=False)}")
-            
-            return response
+            # 较大或长度未知的请求体边读边转发，无法重复发送
+            request_state().stats.incr('hedge', 'skipped_streamed_body')
+            response = send()
+
+        if log_requests and response.status_code == 200 and not is_event_stream(response):
+            if len(response.content) <= MAX_LOGGED_BODY:
+                logger.info(f"[PROXY] Response data: {response.text}")
+            else:
+                logger.info(f"[PROXY] Response data: <{len(response.content)} bytes>")
+
+        return response
     except requests.exceptions.Timeout:
         logger.error(f"[PROXY] Request timeout after {timeout} seconds")
         raise
@@ -122,57 +1028,386 @@ def forward_request(request_data, proxy_config):
         raise
 
 
-def forward_stream_response(response, log_responses=True):
-    """转发流式响应"""
-    for line in response.iter_lines():
-        if line:
-            decoded_line = line.decode('utf-8')
-            if log_responses and decoded_line.startswith('data: '):
-                logger.info(f"[PROXY] Stream chunk: {decoded_line}")
-            yield decoded_line + '\n\n'
+def is_event_stream(response):
+    """上游响应是否为 SSE 流"""
+    return response.headers.get('Content-Type', '').startswith('text/event-stream')
+
+
+def forward_stream_response(response, tenant_stats, log_responses=True):
+    """转发流式响应，结束或被取消时关闭上游响应并归还连接"""
+    completed = False
+    try:
+        for line in response.iter_lines():
+            if line:
+                decoded_line = line.decode('utf-8')
+                if log_responses and decoded_line.startswith('data: '):
+                    logger.info(f"[PROXY] Stream chunk: {decoded_line}")
+                yield decoded_line + '\n\n'
+        completed = True
+    finally:
+        response.close()
+        if not completed:
+            tenant_stats.incr('streams', 'upstream_closed')
+            logger.info("[PROXY] Closed upstream stream early")
+
+
+class CompletionAggregator:
+    """把流式分块（chat.completion.chunk）增量合并为一个 chat.completion 响应
+
+    字符串字段（content、reasoning_content 等）按片段保存，结束时才拼接；
+    tool_calls 按 index 合并，usage 取最后一个携带 usage 的分块。
+    """
+
+    def __init__(self):
+        self.response = {}
+        self.choices = {}
+        self.usage = None
+        self.chunks = 0
 
+    def add(self, chunk):
+        self.chunks += 1
+        if not self.response:
+            self.response = {key: chunk[key] for key in ('id', 'created', 'model', 'system_fingerprint')
+                             if chunk.get(key) is not None}
+        if chunk.get('usage'):
+            self.usage = chunk['usage']
+        for choice in chunk.get('choices') or ():
+            state = self.choices.get(choice.get('index', 0))
+            if state is None:
+                state = self.choices[choice.get('index', 0)] = {
+                    'fields': {'role': 'assistant'}, 'parts': {}, 'tool_calls': {},
+                    'function_call': None, 'finish_reason': None
+                }
+            if choice.get('finish_reason'):
+                state['finish_reason'] = choice['finish_reason']
+            for key, value in (choice.get('delta') or {}).items():
+                if key == 'tool_calls':
+                    for tool_call in value or ():
+                        self._add_tool_call(state['tool_calls'], tool_call)
+                elif key == 'function_call':
+                    if value:
+                        if state['function_call'] is None:
+                            state['function_call'] = {'name': '', 'arguments': []}
+                        self._add_function(state['function_call'], value)
+                elif isinstance(value, str) and key != 'role':
+                    state['parts'].setdefault(key, []).append(value)
+                elif value is not None:
+                    state['fields'][key] = value
+
+    @staticmethod
+    def _add_function(function, delta):
+        if delta.get('name'):
+            function['name'] = delta['name']
+        if delta.get('arguments'):
+            function['arguments'].append(delta['arguments'])
+
+    def _add_tool_call(self, tool_calls, delta):
+        tool_call = tool_calls.get(delta.get('index', len(tool_calls)))
+        if tool_call is None:
+            tool_call = tool_calls[delta.get('index', len(tool_calls))] = {
+                'id': None, 'type': 'function', 'function': {'name': '', 'arguments': []}
+            }
+        if delta.get('id'):
+            tool_call['id'] = delta['id']
+        if delta.get('type'):
+            tool_call['type'] = delta['type']
+        self._add_function(tool_call['function'], delta.get('function') or {})
+
+    def result(self):
+        choices = []
+        for index in sorted(self.choices):
+            state = self.choices[index]
+            message = dict(state['fields'])
+            for key, parts in state['parts'].items():
+                message[key] = ''.join(parts)
+            message.setdefault('content', None)
+            if state['tool_calls']:
+                message['tool_calls'] = [
+                    {'id': tool_call['id'], 'type': tool_call['type'],
+                     'function': {'name': tool_call['function']['name'],
+                                  'arguments': ''.join(tool_call['function']['arguments'])}}
+                    for _, tool_call in sorted(state['tool_calls'].items())
+                ]
+            if state['function_call'] is not None:
+                message['function_call'] = {'name': state['function_call']['name'],
+                                            'arguments': ''.join(state['function_call']['arguments'])}
+            choices.append({'index': index, 'message': message, 'finish_reason': state['finish_reason']})
+        result = {'id': self.response.get('id'), 'object': 'chat.completion',
+                  'created': self.response.get('created', int(time.time())), 'model': self.response.get('model'),
+                  'choices': choices}
+        if 'system_fingerprint' in self.response:
+            result['system_fingerprint'] = self.response['system_fingerprint']
+        if self.usage is not None:
+            result['usage'] = self.usage
+        return result
+
+
+def aggregate_stream_response(response, log_responses=True):
+    """读取上游 SSE 流并聚合为 chat.completion 响应体，上游在流中返回错误时返回该错误"""
+    aggregator = CompletionAggregator()
+    try:
+        for line in response.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            # SSE 规范中 data: 之后的空格可省略
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                break
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError as e:
+                logger.error(f"[PROXY] Invalid stream chunk from target API: {e}")
+                return jsonify({'error': {'message': f'Invalid stream chunk from target API: {e}',
+                                          'type': 'proxy_error'}}), 502
+            if 'error' in chunk:
+                logger.error(f"[PROXY] Target API returned error in stream: {chunk['error']}")
+                return jsonify(chunk), 502
+            aggregator.add(chunk)
+    finally:
+        response.close()
+
+    if not aggregator.chunks:
+        logger.error("[PROXY] Target API returned an empty stream")
+        return jsonify({'error': {'message': 'Target API returned an empty stream', 'type': 'proxy_error'}}), 502
+
+    body = json.dumps(aggregator.result(), ensure_ascii=False).encode('utf-8')
+    if log_responses:
+        if len(body) <= MAX_LOGGED_BODY:
+            logger.info(f"[PROXY] Aggregated response: {body.decode('utf-8')}")
+        else:
+            logger.info(f"[PROXY] Aggregated response: <{len(body)} bytes>")
+    return json_body_response(body)
+
+
+def completion_stream_frames(completion, include_usage=False):
+    """把上游的非流式 chat.completion 响应转换为流式分块（每个 choice 一个 delta 分块和一个结束分块）"""
+    header = {
+        'id': completion.get('id'),
+        'object': 'chat.completion.chunk',
+        'created': completion.get('created', int(time.time())),
+        'model': completion.get('model')
+    }
+    if 'system_fingerprint' in completion:
+        header['system_fingerprint'] = completion['system_fingerprint']
+
+    for choice in completion.get('choices') or ():
+        index = choice.get('index', 0)
+        delta = {key: value for key, value in (choice.get('message') or {}).items() if value is not None}
+        if 'tool_calls' in delta:
+            delta['tool_calls'] = [{'index': i, **tool_call} for i, tool_call in enumerate(delta['tool_calls'])]
+        yield f'data: {json.dumps({**header, "choices": [{"index": index, "delta": delta, "finish_reason": None}]})}\n\n'
+        yield f'data: {json.dumps({**header, "choices": [{"index": index, "delta": {}, "finish_reason": choice.get("finish_reason")}]})}\n\n'
+
+    if include_usage and completion.get('usage') is not None:
+        yield f'data: {json.dumps({**header, "choices": [], "usage": completion["usage"]})}\n\n'
+    yield 'data: [DONE]\n\n'
+
+
+def timed_proxy_stream(frames, mode, started, tenant_stats):
+    """记录代理流式响应的首个分块时间和完整耗时，被取消的流单独记录为 cancelled
+
+    被取消时立即关闭 frames，由其清理逻辑关闭上游响应。
+    """
+    first = True
+    completed = False
+    try:
+        for frame in frames:
+            if first:
+                tenant_stats.observe(f'proxy.{mode}.ttfb', time.perf_counter() - started)
+                first = False
+            yield frame
+        completed = True
+    finally:
+        frames.close()
+        tenant_stats.observe(f"proxy.{mode}.{'total' if completed else 'cancelled'}", time.perf_counter() - started)
 
 
 @app.route('/v1/chat/completions', methods=['POST'])
 def chat_completions():
     try:
-        mode = get_mode()
-        proxy_config = get_proxy_config()
+        profile = start_request_profile()
+
+        with profile_phase('config'):
+            snapshot = request_snapshot()
+            if snapshot is None:
+                return unknown_tenant_response(request.headers.get(TENANT_HEADER))
+            g.config_snapshot = snapshot
+            g.tenant_state = tenant_state(snapshot.tenant)
+            config = snapshot.config
+            if snapshot.tenant is not None:
+                stats.incr('tenants', snapshot.tenant)
+            mode = get_mode(config)
+            proxy_config = get_proxy_config(config)
         
-        data = request.json
-        logger.info(f"Received request: {json.dumps(data)}")
+        max_body_bytes = snapshot.max_body_bytes
+        if request.content_length is not None and request.content_length > max_body_bytes:
+            return body_too_large_response(max_body_bytes)
+        # 长度未知的分块请求体最多读取上限 + 1 字节，由 read_request_body 判断是否超过上限；
+        # 流式转发时读取超过该长度会抛出 RequestEntityTooLarge
+        request.max_content_length = max_body_bytes + 1
         
         if mode == 'proxy' and proxy_config.get('enabled', False):
+            logger.info(f"Received request: {request.content_length or 'unknown'} bytes")
             logger.info(f"[MODE] Using proxy mode")
-            return handle_proxy_request(data, proxy_config)
+            rv = handle_proxy_request(proxy_config)
+            data = g.get('proxy_request_body')
         else:
+            with profile_phase('parse'):
+                data, size = parse_mock_request()
+            if size <= MAX_LOGGED_BODY:
+                logger.info(f"Received request: {json.dumps(data)}")
+            else:
+                logger.info(f"Received request: {size} bytes, model={data.get('model')}, "
+                            f"stream={data.get('stream', False)}, messages={len(data.get('messages') or [])}")
             logger.info(f"[MODE] Using mock mode")
-            return handle_mock_request(data)
-            
+            rv = handle_mock_request(data, snapshot)
+
+        if capture_enabled(config) and data is not None:
+            capture_request(config['capture'].get('path', 'capture.jsonl'), data, g.get('response_path'),
+                            snapshot.tenant)
+
+        if profile is not None:
+            return finish_request_profile(profile, rv)
+        return rv
+
+    except RequestEntityTooLarge:
+        return body_too_large_response(current_snapshot().max_body_bytes)
+    except json.JSONDecodeError as e:
+        return jsonify({'error': {'message': f'Invalid JSON body: {e}', 'type': 'invalid_request_error'}}), 400
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         return jsonify({'error': {'message': str(e), 'type': 'internal_server_error'}}), 500
 
 
-def handle_proxy_request(request_data, proxy_config):
+def body_too_large_response(limit):
+    return jsonify({
+        'error': {
+            'message': f'Request body exceeds the maximum size of {limit} bytes',
+            'type': 'invalid_request_error',
+            'code': 'request_too_large'
+        }
+    }), 413
+
+
+def read_request_body():
+    """读取完整请求体，超过当前配置的 max_body_bytes 时抛出 RequestEntityTooLarge
+
+    长度未知的分块请求体读到 max_content_length 时 get_data 会直接截断而不报错，
+    因此 max_content_length 设为上限 + 1，多读到的一个字节说明请求体超过上限。
+    """
+    body = request.get_data(cache=False)
+    if len(body) > current_snapshot().max_body_bytes:
+        raise RequestEntityTooLarge()
+    return body
+
+
+def unknown_tenant_response(name):
+    return jsonify({
+        'error': {
+            'message': f'Tenant {name} does not exist',
+            'type': 'invalid_request_error',
+            'code': 'tenant_not_found'
+        }
+    }), 404
+
+
+def parse_mock_request():
+    """解析 mock 模式请求体，只保留 MOCK_REQUEST_FIELDS 中的字段，返回 (请求数据, 请求体字节数)"""
+    body = read_request_body()
+    size = len(body)
+    # 先解码再释放原始字节，解析时内存中最多同时存在两份请求体大小的数据
+    text = body.decode('utf-8')
+    del body
+    request_data = json.loads(text)
+    del text
+    if not isinstance(request_data, dict):
+        raise json.JSONDecodeError('request body must be a JSON object', '', 0)
+    return {key: request_data[key] for key in MOCK_REQUEST_FIELDS if key in request_data}, size
+
+
+_capture_lock = threading.Lock()
+
+# replay.py 回放请求携带的请求头
+REPLAY_HEADER = 'X-Mock-Replay'
+
+
+def capture_enabled(config):
+    """当前请求是否需要写入抓包文件
+
+    replay.py 回放的请求不再写入，避免回放时读取的文件被不断追加。
+    """
+    return config.get('capture', {}).get('enabled', False) and not request.headers.get(REPLAY_HEADER)
+
+
+def capture_request(path, request_data, response_path, tenant=None):
+    """把请求追加写入 JSONL 抓包文件，供 replay.py 回放
+
+    request_data 为代理模式下保留的原始请求体字节时先解析再写入；
+    请求属于某个租户时记录租户名，回放时通过 X-Mock-Tenant 请求头发往同一租户。
+    """
+    if isinstance(request_data, bytes):
+        request_data = json.loads(request_data)
+    record = {'ts': time.time(), 'path': response_path, 'request': request_data}
+    if tenant is not None:
+        record['tenant'] = tenant
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _capture_lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+    request_state().stats.incr('capture', 'written')
+
+
+@app.after_request
+def add_response_path(response):
+    """在 X-Mock-Path 响应头中标明响应来源：preset、default、proxy 或 fault"""
+    response_path = g.get('response_path')
+    if response_path is not None:
+        response.headers['X-Mock-Path'] = response_path
+    return response
+
+
+def handle_proxy_request(proxy_config):
     """处理代理模式请求"""
+    g.response_path = 'proxy'
+    tenant_stats = request_state().stats
+    tenant_stats.incr('requests', 'proxy')
     try:
-        is_stream = request_data.get('stream', False)
         log_responses = proxy_config.get('log_responses', True)
+        started = time.perf_counter()
+        body, body_copy, client_stream = read_proxy_body(proxy_config, capture_enabled(current_snapshot().config))
+        g.proxy_request_body = body_copy
+        logged_body = body_copy if body_copy is not None and len(body_copy) <= MAX_LOGGED_BODY else None
         
-        response = forward_request(request_data, proxy_config)
+        with profile_phase('upstream'):
+            response = forward_request(body, proxy_config, logged_body)
         
         if response.status_code != 200:
             logger.error(f"[PROXY] Target API returned error: {response.status_code}")
             return jsonify(response.json()), response.status_code
         
-        if is_stream:
-            return Response(
-                forward_stream_response(response, log_responses),
-                mimetype='text/event-stream'
-            )
+        upstream_stream = is_event_stream(response)
+        # 请求体未解析时客户端的 stream 参数原样发给了上游，按上游响应类型透传
+        client_wants_stream = upstream_stream if client_stream is None else client_stream.stream
+        mode = ('stream' if client_wants_stream else 'stream_to_json') if upstream_stream else \
+            ('json_to_stream' if client_wants_stream else 'json')
+        tenant_stats.incr('proxy_modes', mode)
+
+        if mode == 'stream':
+            frames = forward_stream_response(response, tenant_stats, log_responses)
+            return sse_response(timed_proxy_stream(frames, mode, started, tenant_stats))
+        if mode == 'json_to_stream':
+            frames = completion_stream_frames(response.json(), client_stream.include_usage)
+            return sse_response(timed_proxy_stream(frames, mode, started, tenant_stats))
+
+        if mode == 'stream_to_json':
+            rv = aggregate_stream_response(response, log_responses)
         else:
-            return jsonify(response.json()), 200
+            # 直接转发上游响应体，避免重新解析和序列化
+            rv = json_body_response(response.content)
+        elapsed = time.perf_counter() - started
+        tenant_stats.observe(f'proxy.{mode}.ttfb', elapsed)
+        tenant_stats.observe(f'proxy.{mode}.total', elapsed)
+        return rv
             
     except requests.exceptions.Timeout:
         return jsonify({
@@ -190,35 +1425,86 @@ def handle_proxy_request(request_data, proxy_config):
         }), 502
 
 
-def handle_mock_request(request_data):
+def handle_mock_request(request_data, snapshot=None):
     """处理 mock 模式请求"""
+    if snapshot is None:
+        snapshot = load_config()
+    config = snapshot.config
+
     if not request_data.get('model'):
         return jsonify({'error': {'message': 'model parameter is required', 'type': 'invalid_request_error'}}), 400
     
     if not request_data.get('messages'):
         return jsonify({'error': {'message': 'messages parameter is required', 'type': 'invalid_request_error'}}), 400
     
-    preset = get_preset_response(request_data)
+    request_state().stats.incr('requests', 'mock')
+    is_stream = request_data.get('stream', False)
+
+    with profile_phase('preset_match'):
+        preset = get_preset_response(request_data, config)
+
+    faults = None
+    fault_profile = snapshot.fault_profile(request_data, preset)
+    if fault_profile is not None:
+        faults = fault_profile.plan(is_stream)
+        fault_response = apply_request_faults(faults)
+        if fault_response is not None:
+            g.response_path = 'fault'
+            return fault_response
     
     if preset:
-        if request_data.get('stream', False) and preset.get('stream_response_chunks'):
+        g.response_path = 'preset'
+        if is_stream and preset.get('stream_response_chunks'):
             logger.info(f"Using preset stream response chunks")
-            return Response(stream_preset_chunks(preset.get('stream_response_chunks')), mimetype='text/event-stream')
+            frames = snapshot.preset_streams[id(preset)]
+            return mock_sse_response(stream_preset_chunks(frames, request_data), faults)
         elif preset.get('response'):
             logger.info(f"Using preset non-stream response")
-            return preset.get('response'), 200
+            render = snapshot.preset_templates.get(id(preset))
+            if render is not None:
+                return json_body_response(render(request_data).encode('utf-8'))
+            body = snapshot.preset_bodies[id(preset)]
+            return json_body_response(body.data, encoded=body.encoded)
     
-    response_data = generate_default_response(request_data)
+    g.response_path = 'default'
+    with profile_phase('generate'):
+        response_data = generate_default_response(request_data, snapshot=snapshot)
+
+    # 合成长文本：流式响应边输出边生成，非流式响应一次性拼接
+    content = None
+    chunk_delay = 0.0005
+    message = response_data['choices'][0]['message']
+    synthetic = snapshot.synthetic
+    if synthetic is not None and not message.get('tool_calls') and not message.get('function_call'):
+        count = synthetic.token_count(request_data)
+        seed = request_data.get('seed', synthetic.seed)
+        response_data['usage']['completion_tokens'] = count
+        response_data['usage']['total_tokens'] = response_data['usage']['prompt_tokens'] + count
+        chunk_delay = synthetic.chunk_delay
+        if is_stream:
+            content = synthetic.tokens(count, seed)
+        else:
+            with profile_phase('generate'):
+                message['content'] = synthetic.text(count, seed)
     
-    if request_data.get('stream', False):
-        return Response(stream_response(response_data), mimetype='text/event-stream')
+    if is_stream:
+        return mock_sse_response(stream_response(response_data, content, chunk_delay), faults)
     else:
-        return response_data, 200
+        with profile_phase('serialize'):
+            return json_body_response(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
 
-def get_preset_response(request_data):
+def mock_sse_response(frames, faults=None):
+    """返回 mock 流式响应，有故障注入计划时包装注入逻辑"""
+    if faults is not None:
+        frames = inject_stream_faults(frames, faults, request.environ, request_state().stats)
+    return sse_response(frames)
+
+
+def get_preset_response(request_data, config=None):
     """检查是否有匹配的预设响应"""
-    # 每次调用都重新读取配置文件
-    config = read_config()
+    # 未传入配置时重新读取配置文件
+    if config is None:
+        config = read_config()
     preset_responses = config.get('preset_responses', [])
     
     for preset in preset_responses:
@@ -259,11 +1545,17 @@ def match_messages(request_messages, preset_messages):
             return False
     return True
 
-def generate_default_response(request_data):
-    """生成默认响应"""
-    config = read_config()
+def generate_default_response(request_data, config=None, snapshot=None):
+    """生成默认响应，传入配置快照时使用快照中预先编译的 default_content 模板"""
+    if snapshot is not None:
+        config = snapshot.config
+    elif config is None:
+        config = read_config()
     mock_config = config.get('mock_config', {})
-    default_content = mock_config.get('default_content', 'This is a simulated response from the mock OpenAI API.')
+    default_content = mock_config.get('default_content', DEFAULT_CONTENT)
+    render = snapshot.default_content_render if snapshot is not None else compile_template(default_content)
+    if render is not None:
+        default_content = render(request_data)
     default_model = mock_config.get('default_model', 'gpt-3.5-turbo')
 
     # 检查是否需要工具调用（新版格式）
@@ -274,16 +1566,20 @@ def generate_default_response(request_data):
     function_call = request_data.get('function_call')
     functions = request_data.get('functions', [])
     
-    if tool_choice and tools:
-        # 生成工具调用响应（新版格式）
-        tool_name = 'default_tool'
-        tool_args = {}
-        
-        # 如果有工具定义，使用第一个工具
-        if tools:
-            first_tool = tools[0]
-            if first_tool.get('type') == 'function':
-                tool_name = first_tool['function'].get('name', 'default_tool')
+    if tool_choice and tools and tool_choice != 'none':
+        # 生成工具调用响应（新版格式），参数按工具的 parameters JSON Schema 生成
+        parallel = request_data.get('parallel_tool_calls', mock_config.get('parallel_tool_calls', False))
+        tool_calls = [
+            {
+                'id': f'toolcall-{str(uuid.uuid4())[:16]}',
+                'type': 'function',
+                'function': {
+                    'name': function.get('name', 'default_tool'),
+                    'arguments': generate_tool_arguments(function.get('parameters'))
+                }
+            }
+            for function in select_tool_functions(tools, tool_choice, parallel)
+        ]
         
         return {
             'id': f'chatcmpl-{str(uuid.uuid4())[:28]}',
@@ -296,16 +1592,7 @@ def generate_default_response(request_data):
                     'message': {
                         'role': 'assistant',
                         'content': None,
-                        'tool_calls': [
-                            {
-                                'id': f'toolcall-{str(uuid.uuid4())[:16]}',
-                                'type': 'function',
-                                'function': {
-                                    'name': tool_name,
-                                    'arguments': json.dumps(tool_args)
-                                }
-                            }
-                        ]
+                        'tool_calls': tool_calls
                     },
                     'finish_reason': 'tool_calls'
                 }
@@ -324,7 +1611,14 @@ def generate_default_response(request_data):
         # 处理function_call参数可能是字符串或对象的情况
         if isinstance(function_call, dict):
             function_name = function_call.get('name', 'default_function')
-            function_args = function_call.get('arguments', {})
+            function_args = function_call.get('arguments')
+            if function_args is None:
+                # 未指定参数时按同名函数的 parameters JSON Schema 生成
+                function_args = {}
+                for function in functions:
+                    if function.get('name') == function_name and function.get('parameters'):
+                        function_args = json.loads(generate_tool_arguments(function['parameters']))
+                        break
         
         return {
             'id': f'chatcmpl-{str(uuid.uuid4())[:28]}',
@@ -375,201 +1669,721 @@ def generate_default_response(request_data):
             }
         }
 
-def stream_preset_chunks(chunks):
-    """生成预设的流式响应分块"""
+# 响应模板占位符，例如 {{ last_user_message }}
+TEMPLATE_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+# 模板值的转义方式：json 对应 ensure_ascii=False 序列化的 JSON 文本，json_ascii 对应默认的 json.dumps 输出，
+# sse 用于非 JSON 的 SSE 文本行，把换行转义为字面 \n，避免插入的值拆出额外的 SSE 事件
+TEMPLATE_ESCAPES = {
+    None: None,
+    'json': lambda value: encode_basestring(value)[1:-1],
+    'json_ascii': lambda value: encode_basestring_ascii(value)[1:-1],
+    'sse': lambda value: value.replace('\r', '\\r').replace('\n', '\\n')
+}
+
+
+def message_text(message):
+    """提取消息的文本内容，兼容多模态消息的分段格式"""
+    content = message.get('content')
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+def last_user_message(request_data):
+    for message in reversed(request_data.get('messages') or []):
+        if message.get('role') == 'user':
+            return message_text(message)
+    return ''
+
+
+def tool_names(request_data):
+    names = [tool.get('function', {}).get('name', '') for tool in request_data.get('tools') or []]
+    names += [function.get('name', '') for function in request_data.get('functions') or []]
+    return ', '.join(name for name in names if name)
+
+
+# 模板可用的字段，值均为字符串
+TEMPLATE_FIELDS = {
+    'model': lambda request_data: str(request_data.get('model', '')),
+    'user': lambda request_data: str(request_data.get('user', '')),
+    'message_count': lambda request_data: str(len(request_data.get('messages') or [])),
+    'last_user_message': last_user_message,
+    'tool_names': tool_names,
+    'tool_count': lambda request_data: str(len(request_data.get('tools') or request_data.get('functions') or []))
+}
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text, escape=None):
+    """把含 {{ 字段 }} 占位符的模板编译为渲染函数 render(request_data) -> str
+
+    不含已知字段占位符时返回 None，调用方直接使用原文。
+    escape 为插入值的转义方式（见 TEMPLATE_ESCAPES），用于模板本身是 JSON 文本的情况。
+    结果按 (text, escape) 缓存，配置加载时即完成编译。
+    """
+    escape_value = TEMPLATE_ESCAPES[escape]
+    literals = []
+    getters = []
+    position = 0
+    for match in TEMPLATE_PATTERN.finditer(text):
+        # 未知字段保留原样
+        if match.group(1) not in TEMPLATE_FIELDS:
+            continue
+        literals.append(text[position:match.start()])
+        getters.append(TEMPLATE_FIELDS[match.group(1)])
+        position = match.end()
+    if not getters:
+        return None
+    literals.append(text[position:])
+
+    head = literals[0]
+    parts = list(zip(getters, literals[1:]))
+
+    def render(request_data):
+        output = [head]
+        for getter, literal in parts:
+            value = getter(request_data)
+            output.append(escape_value(value) if escape_value else value)
+            output.append(literal)
+        return ''.join(output)
+
+    return render
+
+
+def select_tool_functions(tools, tool_choice, parallel=False):
+    """按 tool_choice 选择要调用的工具函数定义
+
+    指定了具体函数时只调用该函数；否则并行模式调用全部工具，非并行模式调用第一个工具。
+    """
+    functions = [tool.get('function', {}) for tool in tools if tool.get('type', 'function') == 'function']
+    if isinstance(tool_choice, dict):
+        name = tool_choice.get('function', {}).get('name')
+        for function in functions:
+            if function.get('name') == name:
+                return [function]
+        return [{'name': name or 'default_tool'}]
+    if not functions:
+        return [{'name': 'default_tool'}]
+    return functions if parallel else functions[:1]
+
+
+def generate_tool_arguments(parameters):
+    """按 JSON Schema 生成工具调用参数（JSON 字符串）"""
+    if not parameters:
+        return '{}'
+    return compile_schema_generator(SchemaKey(parameters))()
+
+
+class SchemaKey:
+    """schema 的缓存键：按规范化的 JSON 文本比较，同时携带原始 schema 用于编译（保留属性顺序）"""
+
+    __slots__ = ('schema', 'text')
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.text = json.dumps(schema, sort_keys=True)
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __eq__(self, other):
+        return isinstance(other, SchemaKey) and self.text == other.text
+
+
+@functools.lru_cache(maxsize=256)
+def compile_schema_generator(schema_key):
+    """把 JSON Schema 编译为参数生成函数，按规范化后的 schema 文本缓存
+
+    Agent 每轮都会发送相同的工具列表，命中缓存时不再遍历 schema。
+    """
+    schema = schema_key.schema
+    build = compile_schema(schema, schema, 'value')
+    if build is None:
+        return lambda: '{}'
+    return lambda: json.dumps(build(), ensure_ascii=False)
+
+
+# 常见 string format 的示例值
+SCHEMA_STRING_FORMATS = {
+    'date-time': '2024-01-01T00:00:00Z',
+    'date': '2024-01-01',
+    'time': '00:00:00',
+    'email': 'user@example.com',
+    'uri': 'https://example.com',
+    'url': 'https://example.com',
+    'uuid': '00000000-0000-4000-8000-000000000000',
+    'ipv4': '127.0.0.1',
+    'hostname': 'example.com'
+}
+
+# allOf 合并时取更严格值的数值约束
+SCHEMA_LOWER_BOUNDS = ('minimum', 'exclusiveMinimum', 'minLength', 'minItems')
+SCHEMA_UPPER_BOUNDS = ('maximum', 'exclusiveMaximum', 'maxLength', 'maxItems')
+
+
+def is_schema_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def resolve_schema_ref(ref, root):
+    """解析本地引用，例如 #/$defs/Location"""
+    node = root
+    for part in ref.lstrip('#/').split('/'):
+        if part and isinstance(node, dict):
+            node = node.get(part.replace('~1', '/').replace('~0', '~'), {})
+    return node
+
+
+def merge_all_of(schema, root):
+    """把 allOf 的各部分合并为一个 schema 节点
+
+    properties 合并、required 取并集、数值约束取更严格的值，其余关键字以先出现的为准。
+    """
+    merged = {key: value for key, value in schema.items() if key != 'allOf'}
+    for part in schema['allOf']:
+        if isinstance(part, dict) and '$ref' in part:
+            part = resolve_schema_ref(part['$ref'], root)
+        if not isinstance(part, dict):
+            continue
+        if 'allOf' in part:
+            part = merge_all_of(part, root)
+        for key, value in part.items():
+            current = merged.get(key)
+            if key == 'properties' and isinstance(value, dict):
+                merged[key] = {**(current or {}), **value}
+            elif key == 'required' and isinstance(value, list):
+                merged[key] = list(dict.fromkeys((current or []) + value))
+            elif key in SCHEMA_LOWER_BOUNDS and is_schema_number(value) and is_schema_number(current):
+                merged[key] = max(current, value)
+            elif key in SCHEMA_UPPER_BOUNDS and is_schema_number(value) and is_schema_number(current):
+                merged[key] = min(current, value)
+            elif key not in merged:
+                merged[key] = value
+    return merged
+
+
+def infer_schema_type(schema):
+    """未声明 type 时按出现的关键字推断类型"""
+    if 'properties' in schema or 'required' in schema:
+        return 'object'
+    if 'items' in schema or 'minItems' in schema or 'maxItems' in schema:
+        return 'array'
+    if any(key in schema for key in SCHEMA_LOWER_BOUNDS[:2] + SCHEMA_UPPER_BOUNDS[:2] + ('multipleOf',)):
+        return 'number'
+    return 'string'
+
+
+def compile_schema(schema, root, name, refs=()):
+    """把单个 schema 节点编译为返回示例值的函数，生成的值满足 schema 的约束
+
+    无法生成合法值时返回 None（例如 false schema、无法满足的约束、递归引用），
+    可选属性因此被省略，必需属性则使上层同样无法生成。
+    布尔值 schema true 接受任意值，生成 null。refs 为正在展开的引用，用于终止递归。
+    """
+    if schema is True:
+        return lambda: None
+    if not isinstance(schema, dict):
+        return None
+    if '$ref' in schema:
+        ref = schema['$ref']
+        if ref in refs:
+            return None
+        return compile_schema(resolve_schema_ref(ref, root), root, name, refs + (ref,))
+    for key in ('const', 'default'):
+        if key in schema:
+            value = schema[key]
+            return lambda: value
+    if schema.get('enum'):
+        value = schema['enum'][0]
+        return lambda: value
+    if schema.get('examples'):
+        value = schema['examples'][0]
+        return lambda: value
+    if schema.get('allOf'):
+        return compile_schema(merge_all_of(schema, root), root, name, refs)
+    for key in ('anyOf', 'oneOf'):
+        if schema.get(key):
+            options = [option for option in schema[key] if option is True or isinstance(option, dict)]
+            # 优先选择非 null 的分支
+            options.sort(key=lambda option: isinstance(option, dict) and option.get('type') == 'null')
+            for option in options:
+                build = compile_schema(option, root, name, refs)
+                if build is not None:
+                    return build
+            return None
+
+    schema_type = schema.get('type')
+    if isinstance(schema_type, list):
+        schema_type = next((item for item in schema_type if item != 'null'), 'null')
+    if schema_type is None:
+        schema_type = infer_schema_type(schema)
+
+    if schema_type == 'object':
+        required = set(schema.get('required') or ())
+        fields = []
+        for key, value in (schema.get('properties') or {}).items():
+            build = compile_schema(value, root, key, refs)
+            if build is not None:
+                fields.append((key, build))
+            elif key in required:
+                return None
+        return lambda: {key: build() for key, build in fields}
+    if schema_type == 'array':
+        min_items = schema.get('minItems', 0)
+        count = max(min_items, 1)
+        if schema.get('uniqueItems'):
+            # 生成的元素都相同，唯一性约束下最多生成一个
+            count = 1
+        if 'maxItems' in schema:
+            count = min(count, schema['maxItems'])
+        build_item = compile_schema(schema.get('items', True), root, name, refs)
+        if build_item is None:
+            count = 0
+        if count < min_items:
+            return None
+        return lambda: [build_item() for _ in range(count)]
+    if schema_type == 'integer' or schema_type == 'number':
+        value = schema_number(schema, schema_type == 'integer')
+        if value is None:
+            return None
+        return lambda: value
+    if schema_type == 'boolean':
+        return lambda: True
+    if schema_type == 'null':
+        return lambda: None
+
+    value = schema_string(schema, name)
+    if value is None:
+        return None
+    return lambda: value
+
+
+def schema_bound(schema, inclusive_key, exclusive_key):
+    """读取数值上/下界，返回 (边界, 是否为开区间)，没有边界时为 (None, False)
+
+    draft 4 中 exclusiveMinimum/exclusiveMaximum 为修饰 minimum/maximum 的布尔值，之后的版本为数值。
+    """
+    bound = schema.get(inclusive_key)
+    exclusive = schema.get(exclusive_key)
+    if isinstance(exclusive, bool):
+        return bound, exclusive and bound is not None
+    if is_schema_number(exclusive) and (bound is None or exclusive >= bound):
+        return exclusive, True
+    return bound, False
+
+
+def schema_number(schema, integer):
+    """生成满足上下界和 multipleOf 的数值，默认为 1，约束无法满足时返回 None"""
+    lower, lower_exclusive = schema_bound(schema, 'minimum', 'exclusiveMinimum')
+    upper, upper_exclusive = schema_bound(schema, 'maximum', 'exclusiveMaximum')
+    if integer:
+        # 整数向区间内取整
+        if lower is not None:
+            lower = math.floor(lower) + 1 if lower_exclusive else math.ceil(lower)
+            lower_exclusive = False
+        if upper is not None:
+            upper = math.ceil(upper) - 1 if upper_exclusive else math.floor(upper)
+            upper_exclusive = False
+        value = 1 if lower is None else lower
+        if upper is not None and value > upper:
+            value = upper
+    else:
+        if lower is None:
+            value = 1.0
+        else:
+            value = float(lower + 1 if lower_exclusive else lower)
+        if upper is not None and (value > upper or (upper_exclusive and value >= upper)):
+            if lower is not None:
+                value = (lower + upper) / 2
+            else:
+                value = float(upper - 1 if upper_exclusive else upper)
+
+    def above_lower(candidate):
+        return lower is None or candidate > lower or (candidate == lower and not lower_exclusive)
+
+    def below_upper(candidate):
+        return upper is None or candidate < upper or (candidate == upper and not upper_exclusive)
+
+    multiple = schema.get('multipleOf')
+    if is_schema_number(multiple) and multiple > 0:
+        # 取不小于当前值的最近倍数，超出上界时取不大于上界的最近倍数
+        value = math.ceil(value / multiple) * multiple
+        if not above_lower(value):
+            value += multiple
+        if not below_upper(value):
+            value = math.floor(upper / multiple) * multiple
+            if not below_upper(value):
+                value -= multiple
+    if not (above_lower(value) and below_upper(value)):
+        return None
+    return int(value) if integer else float(value)
+
+
+def schema_string(schema, name):
+    """生成满足 format、pattern、minLength/maxLength 的字符串，约束无法满足时返回 None"""
+    min_length = schema.get('minLength', 0)
+    max_length = schema.get('maxLength')
+    if max_length is not None and min_length > max_length:
+        return None
+
+    def fits(candidate):
+        return len(candidate) >= min_length and (max_length is None or len(candidate) <= max_length)
+
+    value = SCHEMA_STRING_FORMATS.get(schema.get('format'), f'example_{name}')
+    pattern = schema.get('pattern')
+    if pattern is None:
+        if len(value) < min_length:
+            value = value.ljust(min_length, 'x')
+        if max_length is not None:
+            value = value[:max_length]
+        return value
+
+    try:
+        compiled = re.compile(pattern)
+    except re.error:
+        return None
+    if fits(value) and compiled.search(value):
+        return value
+    # 按不同的重复次数生成匹配 pattern 的字符串，取第一个满足长度约束的
+    for repeat in dict.fromkeys((1, 0, min_length, max_length or 0)):
+        value = sample_regex(pattern, repeat)
+        if value is not None and fits(value) and compiled.search(value):
+            return value
+    return None
+
+
+# 正则字符类中的类别：(示例字符, 用于判断字符是否属于该类别的正则)
+REGEX_CATEGORIES = {
+    'CATEGORY_DIGIT': ('0', r'\d'),
+    'CATEGORY_NOT_DIGIT': ('a', r'\D'),
+    'CATEGORY_SPACE': (' ', r'\s'),
+    'CATEGORY_NOT_SPACE': ('a', r'\S'),
+    'CATEGORY_WORD': ('a', r'\w'),
+    'CATEGORY_NOT_WORD': ('-', r'\W')
+}
+
+
+def sample_regex(pattern, repeat=1):
+    """生成匹配正则表达式的示例字符串，量词尽量重复 repeat 次；遇到不支持的语法返回 None"""
+    try:
+        return sample_regex_items(regex_parser.parse(pattern), repeat)
+    except (re.error, ValueError, TypeError, IndexError, OverflowError):
+        return None
+
+
+def sample_regex_items(items, repeat):
+    output = []
+    for op, value in items:
+        op = str(op)
+        if op == 'LITERAL':
+            output.append(chr(value))
+        elif op == 'NOT_LITERAL':
+            output.append('a' if value != ord('a') else 'b')
+        elif op == 'ANY':
+            output.append('a')
+        elif op == 'IN':
+            output.append(sample_regex_class(value))
+        elif op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            low, high, sub = value
+            output.append(sample_regex_items(sub, repeat) * max(low, min(high, repeat)))
+        elif op in ('SUBPATTERN', 'ATOMIC_GROUP'):
+            output.append(sample_regex_items(value[-1], repeat))
+        elif op == 'BRANCH':
+            output.append(sample_regex_items(value[1][0], repeat))
+        elif op != 'AT':
+            raise ValueError(f'unsupported regex syntax: {op}')
+    return ''.join(output)
+
+
+def sample_regex_class(items):
+    """字符类（[...]、\\d 等）的示例字符，取类中第一个字符；取反的字符类从常见字符中挑选"""
+    if items and str(items[0][0]) == 'NEGATE':
+        excluded = items[1:]
+        for candidate in 'aA0_- ':
+            if not any(regex_class_contains(item, candidate) for item in excluded):
+                return candidate
+        raise ValueError('negated character class excludes all samples')
+    op, value = items[0]
+    op = str(op)
+    if op == 'LITERAL':
+        return chr(value)
+    if op == 'RANGE':
+        return chr(value[0])
+    if op == 'CATEGORY':
+        return REGEX_CATEGORIES[str(value)][0]
+    raise ValueError(f'unsupported character class: {op}')
+
+
+def regex_class_contains(item, char):
+    op, value = item
+    op = str(op)
+    if op == 'LITERAL':
+        return chr(value) == char
+    if op == 'RANGE':
+        return value[0] <= ord(char) <= value[1]
+    if op == 'CATEGORY':
+        return re.fullmatch(REGEX_CATEGORIES[str(value)][1], char) is not None
+    return True
+
+
+LOREM_TEXT = (
+    'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et '
+    'dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex '
+    'ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat '
+    'nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit '
+    'anim id est laborum.'
+)
+
+
+def build_markov_chain(corpus):
+    """由语料构建一阶马尔可夫链：单词 -> 可能的后继单词"""
+    words = corpus.split()
+    chain = {}
+    for current, following in zip(words, words[1:]):
+        chain.setdefault(current, []).append(following)
+    return {word: tuple(followers) for word, followers in chain.items()}, tuple(words)
+
+
+class SyntheticText:
+    """按种子生成的合成长文本，用于压测大输出
+
+    支持的字段（mock_config.synthetic）：
+    - kind: lorem（默认，lorem ipsum 词表）、words（自定义词表 words）或 markov（由 corpus 语料构建马尔可夫链）
+    - length: 输出的 token 数，请求带 max_tokens 时取两者较小值，默认 256
+    - seed: 随机种子，请求中的 seed 参数优先
+    - chunk_delay: 流式输出每个 token 之间的延迟（秒），默认 0.0005
+
+    每个 token 为一个单词（含前导空格），按需逐个生成，内存占用与输出长度无关。
+    """
+
+    def __init__(self, options):
+        self.kind = options.get('kind', 'lorem')
+        self.length = options.get('length')
+        self.seed = options.get('seed', 0)
+        self.chunk_delay = float(options.get('chunk_delay', 0.0005))
+        if self.kind == 'markov':
+            self.chain, self.words = build_markov_chain(options.get('corpus') or LOREM_TEXT)
+        else:
+            self.chain = None
+            if self.kind == 'words' and options.get('words'):
+                self.words = tuple(options['words'])
+            else:
+                self.words = tuple(word.strip('.,').lower() for word in LOREM_TEXT.split())
+
+    def token_count(self, request_data):
+        limits = [value for value in (self.length, request_data.get('max_tokens')) if value]
+        return min(limits) if limits else 256
+
+    def tokens(self, count, seed=None):
+        """逐个生成 token"""
+        rng = random.Random(self.seed if seed is None else seed)
+        words = self._markov_words(rng) if self.chain is not None else self._sentence_words(rng)
+        for index in range(count):
+            word = next(words)
+            yield word if index == 0 else ' ' + word
+
+    def _markov_words(self, rng):
+        word = rng.choice(self.words)
+        while True:
+            yield word
+            followers = self.chain.get(word)
+            word = rng.choice(followers) if followers else rng.choice(self.words)
+
+    def _sentence_words(self, rng):
+        """从词表随机取词并断句：句首大写，句尾加句号"""
+        while True:
+            length = rng.randint(6, 16)
+            for position in range(length):
+                word = rng.choice(self.words)
+                if position == 0:
+                    word = word.capitalize()
+                if position == length - 1:
+                    word += '.'
+                yield word
+
+    def text(self, count, seed=None):
+        """一次性生成完整文本，与 tokens 的拼接结果一致"""
+        return ''.join(self.tokens(count, seed))
+
+
+class StreamEncoder:
+    """流式分块（SSE 帧）编码器
+
+    每个响应只预先计算一次分块中固定不变的前缀和后缀字节，
+    每帧只对 delta 中变化的部分做 JSON 转义，并写入复用的缓冲区。
+    """
+
+    def __init__(self, response_id, created, model):
+        header = json.dumps({
+            'id': response_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model
+        })
+        self._prefix = f'data: {header[:-1]}, "choices": [{{"index": 0, "delta": '.encode('utf-8')
+        self._suffixes = {}
+        self._buffer = bytearray()
+
+    def _suffix(self, finish_reason):
+        suffix = self._suffixes.get(finish_reason)
+        if suffix is None:
+            suffix = f', "finish_reason": {json.dumps(finish_reason)}}}]}}\n\n'.encode('utf-8')
+            self._suffixes[finish_reason] = suffix
+        return suffix
+
+    def _write(self, head, payload, tail, suffix):
+        buffer = self._buffer
+        del buffer[:]
+        buffer += self._prefix
+        buffer += head
+        buffer += payload
+        buffer += tail
+        buffer += suffix
+        return bytes(buffer)
+
+    def frame(self, delta, finish_reason=None):
+        """编码一个完整的 delta 分块"""
+        return self._write(b'', json.dumps(delta).encode('utf-8'), b'', self._suffix(finish_reason))
+
+    def delta_writer(self, head, tail):
+        """返回只需转义单个字符串字段的快速编码函数
+
+        head/tail 为该字段外层 delta 结构的 JSON 文本，例如 '{"content": ' 和 '}'。
+        """
+        head = head.encode('utf-8')
+        tail = tail.encode('utf-8')
+        suffix = self._suffix(None)
+        write = self._write
+
+        def emit(text):
+            return write(head, encode_basestring_ascii(text).encode('ascii'), tail, suffix)
+
+        return emit
+
+
+def compile_stream_chunks(chunks):
+    """把预设的流式分块预先编译为 SSE 帧，含模板占位符的分块编译为渲染函数"""
+    frames = []
     for chunk in chunks:
         # 确保每个分块都是有效的JSON
         try:
             # 如果分块已经是字符串，直接返回
             if isinstance(chunk, str):
-                yield f'{chunk}\n\n'
+                frame = f'{chunk}\n\n'
+                render = compile_template(frame, 'json_ascii' if chunk.startswith('data: {') else 'sse')
             # 如果分块是字典，转换为JSON字符串
             else:
-                yield f'data: {json.dumps(chunk)}\n\n'
-            # 模拟延迟，使流更真实
-            time.sleep(0.0005)
+                frame = f'data: {json.dumps(chunk)}\n\n'
+                render = compile_template(frame, 'json_ascii')
+            frames.append(render or frame)
         except Exception as e:
             logger.error(f"Error processing chunk: {chunk}, error: {e}")
             continue
+    return frames
+
+
+def stream_preset_chunks(frames, request_data=None):
+    """生成预设的流式响应分块"""
+    for frame in frames:
+        yield frame(request_data) if callable(frame) else frame
+        # 模拟延迟，使流更真实
+        time.sleep(0.0005)
     
     # 结束流
     yield 'data: [DONE]\n\n'
 
 
-def stream_response(response_data):
-    """生成流式响应"""
+def stream_response(response_data, content=None, chunk_delay=0.0005):
+    """生成流式响应
+
+    content 为可选的内容片段迭代器（例如合成文本的 token），默认逐字符输出 message.content。
+    """
     # 模拟流式响应的分块输出
     messages = response_data['choices'][0]['message']
-    
+    encoder = StreamEncoder(response_data['id'], response_data['created'], response_data['model'])
+
     if messages.get('tool_calls'):
         # 流式输出工具调用
-        tool_call = messages['tool_calls'][0]
-        tool_id = tool_call['id']
-        tool_name = tool_call['function']['name']
-        
-        # 输出初始工具调用信息
-        yield f'data: {json.dumps({
-            "id": response_data["id"],
-            "object": "chat.completion.chunk",
-            "created": response_data["created"],
-            "model": response_data["model"],
-            "choices": [{
-                "index": 0,
-                "delta": {
-                    "role": "assistant",
-                    "tool_calls": [{
-                        "id": tool_id,
-                        "type": "function",
-                        "function": {
-                            "name": tool_name,
-                            "arguments": ""
-                        }
-                    }]
-                },
-                "finish_reason": None
-            }]})}\n\n'
-        
-        # 模拟延迟
-        time.sleep(0.0005)
-        
-        # 输出arguments的每个字符
-        arguments = tool_call['function']['arguments']
-        for char in arguments:
-            yield f'data: {json.dumps({
-                "id": response_data["id"],
-                "object": "chat.completion.chunk",
-                "created": response_data["created"],
-                "model": response_data["model"],
-                "choices": [{
-                    "index": 0,
-                    "delta": {
-                        "tool_calls": [{
-                            "index": 0,
-                            "function": {
-                                "arguments": char
-                            }
-                        }]
-                    },
-                    "finish_reason": None
-                }]})}\n\n'
-            time.sleep(0.0005)
-        
-        # 输出完成
-        yield f'data: {json.dumps({
-            "id": response_data["id"],
-            "object": "chat.completion.chunk",
-            "created": response_data["created"],
-            "model": response_data["model"],
-            "choices": [{
-                "index": 0,
-                "delta": {},
-                "finish_reason": "tool_calls"
-            }]})}\n\n'
+        yield from stream_tool_call_frames(encoder, messages['tool_calls'])
     elif messages.get('function_call'):
         # 流式输出函数调用
-        yield f'data: {json.dumps({
-            "id": response_data["id"],
-            "object": "chat.completion.chunk",
-            "created": response_data["created"],
-            "model": response_data["model"],
-            "choices": [{
-                "index": 0,
-                "delta": {
-                    "role": "assistant",
-                    "function_call": {
-                        "name": messages["function_call"]["name"],
-                        "arguments": ""
-                    }
-                },
-                "finish_reason": None
-            }]})}\n\n'
-        
-        # 模拟延迟
-        time.sleep(0.5)
-        
-        # 输出arguments的每个字符
-        arguments = messages["function_call"]["arguments"]
-        for char in arguments:
-            yield f'data: {json.dumps({
-                "id": response_data["id"],
-                "object": "chat.completion.chunk",
-                "created": response_data["created"],
-                "model": response_data["model"],
-                "choices": [{
-                    "index": 0,
-                    "delta": {
-                        "function_call": {
-                            "arguments": char
-                        }
-                    },
-                    "finish_reason": None
-                }]})}\n\n'
-            time.sleep(0.0005)
-        
-        # 输出完成
-        yield f'data: {json.dumps({
-            "id": response_data["id"],
-            "object": "chat.completion.chunk",
-            "created": response_data["created"],
-            "model": response_data["model"],
-            "choices": [{
-                "index": 0,
-                "delta": {},
-                "finish_reason": "function_call"
-            }]})}\n\n'
+        first_delta = {
+            'role': 'assistant',
+            'function_call': {
+                'name': messages['function_call']['name'],
+                'arguments': ''
+            }
+        }
+        emit_delta = encoder.delta_writer('{"function_call": {"arguments": ', '}}')
+        yield from stream_delta_frames(encoder, first_delta, emit_delta,
+                                       messages['function_call']['arguments'], 'function_call', 0.5)
     else:
         # 流式输出普通响应
-        yield f'data: {json.dumps({
-            "id": response_data["id"],
-            "object": "chat.completion.chunk",
-            "created": response_data["created"],
-            "model": response_data["model"],
-            "choices": [{
-                "index": 0,
-                "delta": {
-                    "role": "assistant"
-                },
-                "finish_reason": None
-            }]})}\n\n'
-        
+        emit_delta = encoder.delta_writer('{"content": ', '}')
+        yield from stream_delta_frames(encoder, {'role': 'assistant'}, emit_delta,
+                                       messages['content'] if content is None else content, 'stop', 0.0005,
+                                       chunk_delay)
+
+    # 结束流
+    yield b'data: [DONE]\n\n'
+
+
+def stream_tool_call_frames(encoder, tool_calls):
+    """流式输出工具调用（可能有多个并行调用）：每个调用先输出 id 和名称，再逐字符输出 arguments"""
+    for index, tool_call in enumerate(tool_calls):
+        delta = {
+            'tool_calls': [{
+                'index': index,
+                'id': tool_call['id'],
+                'type': 'function',
+                'function': {
+                    'name': tool_call['function']['name'],
+                    'arguments': ''
+                }
+            }]
+        }
+        if index == 0:
+            delta = {'role': 'assistant', **delta}
+        yield encoder.frame(delta)
+
         # 模拟延迟
         time.sleep(0.0005)
-        
-        # 输出content的每个字符
-        content = messages["content"]
-        for char in content:
-            yield f'data: {json.dumps({
-                "id": response_data["id"],
-                "object": "chat.completion.chunk",
-                "created": response_data["created"],
-                "model": response_data["model"],
-                "choices": [{
-                    "index": 0,
-                    "delta": {
-                        "content": char
-                    },
-                    "finish_reason": None
-                }]})}\n\n'
+
+        # 输出arguments的每个字符
+        emit_delta = encoder.delta_writer(
+            f'{{"tool_calls": [{{"index": {index}, "function": {{"arguments": ', '}}]}')
+        for char in tool_call['function']['arguments']:
+            yield emit_delta(char)
             time.sleep(0.0005)
-        
-        # 输出完成
-        yield f'data: {json.dumps({
-            "id": response_data["id"],
-            "object": "chat.completion.chunk",
-            "created": response_data["created"],
-            "model": response_data["model"],
-            "choices": [{
-                "index": 0,
-                "delta": {},
-                "finish_reason": "stop"
-            }]})}\n\n'
-    
-    # 结束流
-    yield 'data: [DONE]\n\n'
+
+    # 输出完成
+    yield encoder.frame({}, 'tool_calls')
+
+
+def stream_delta_frames(encoder, first_delta, emit_delta, text, finish_reason, first_delay, chunk_delay=0.0005):
+    """按字符（或 text 迭代出的片段）输出增量分块：首个分块、逐字符分块、结束分块"""
+    yield encoder.frame(first_delta)
+
+    # 模拟延迟
+    time.sleep(first_delay)
+
+    # 逐字符输出
+    for char in text:
+        yield emit_delta(char)
+        if chunk_delay:
+            time.sleep(chunk_delay)
+
+    # 输出完成
+    yield encoder.frame({}, finish_reason)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Mock OpenAI API Server')
     parser.add_argument('--port', type=int, default=5001, help='Port to run the server on (default: 5001)')
+    parser.add_argument('--enable-profiling', action='store_true',
+                        help='Enable per-request profiling (X-Mock-Profile header or ?profile=1) and /api/profile/sample')
     args = parser.parse_args()
+    PROFILING_ENABLED = args.enable_profiling
     
     app.run(host='0.0.0.0', port=args.port, debug=True)
@@ -0,0 +1,60 @@
+import argparse
+import json
+import time
+import uuid
+
+from app import StreamEncoder
+
+
+def legacy_content_frame(response_data, char):
+    """旧实现：每个字符构建完整字典并整体 json.dumps"""
+    return f'data: {json.dumps({"id": response_data["id"], "object": "chat.completion.chunk", "created": response_data["created"], "model": response_data["model"], "choices": [{"index": 0, "delta": {"content": char}, "finish_reason": None}]})}\n\n'
+
+
+def bench_legacy(response_data, content):
+    for char in content:
+        legacy_content_frame(response_data, char).encode('utf-8')
+
+
+def bench_encoder(response_data, content):
+    encoder = StreamEncoder(response_data['id'], response_data['created'], response_data['model'])
+    emit_delta = encoder.delta_writer('{"content": ', '}')
+    for char in content:
+        emit_delta(char)
+
+
+def run(name, func, response_data, content, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(response_data, content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    fps = len(content) / best
+    print(f'{name:<10} {fps:>14,.0f} frames/s  ({best * 1000:.1f} ms / {len(content)} frames)')
+    return fps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark SSE frame encoding of stream_response')
+    parser.add_argument('--frames', type=int, default=200000, help='Number of content frames per run (default: 200000)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, best one is reported (default: 5)')
+    args = parser.parse_args()
+
+    response_data = {
+        'id': f'chatcmpl-{str(uuid.uuid4())[:28]}',
+        'created': int(time.time()),
+        'model': 'gpt-3.5-turbo'
+    }
+    sample = 'This is a simulated response from the mock OpenAI API. 这是模拟响应。"\\\n'
+    content = (sample * (args.frames // len(sample) + 1))[:args.frames]
+
+    # 确认新旧实现输出的字节完全一致
+    encoder = StreamEncoder(response_data['id'], response_data['created'], response_data['model'])
+    emit_delta = encoder.delta_writer('{"content": ', '}')
+    for char in sample:
+        assert emit_delta(char) == legacy_content_frame(response_data, char).encode('utf-8'), char
+
+    before = run('before', bench_legacy, response_data, content, args.repeat)
+    after = run('after', bench_encoder, response_data, content, args.repeat)
+    print(f'speedup    {after / before:.2f}x')
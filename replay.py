@@ -0,0 +1,232 @@
+import re
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import Counter
+from datetime import datetime
+
+import aiohttp
+
+# 回放请求携带的请求头，与 app.py 的 REPLAY_HEADER 一致
+REPLAY_HEADER = 'X-Mock-Replay'
+TENANT_HEADER = 'X-Mock-Tenant'
+
+# app.py 日志中记录请求的行，例如：2026-01-01 12:00:00,123 - __main__ - INFO - Received request: {...}
+LOG_LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) .*?Received request: (\{.*\})\s*$')
+
+
+def parse_capture_line(line):
+    """解析一行抓包记录，返回 (时间戳, 请求体, 预期响应来源, 租户名)，无法识别时返回 None
+
+    支持三种格式：
+    - app.py 开启 capture 后写入的 JSONL：{"ts": ..., "path": ..., "request": {...}, "tenant": ...}
+    - 每行一个请求体的 JSONL：{"model": ..., "messages": [...]}
+    - app.py 的日志行：... Received request: {...}
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(record.get('request'), dict):
+            return (record.get('ts'), record['request'], record.get('path') or record.get('expected_path'),
+                    record.get('tenant'))
+        if 'messages' in record:
+            return None, record, None, None
+        return None
+    match = LOG_LINE_PATTERN.match(line)
+    if match:
+        try:
+            request_data = json.loads(match.group(2))
+        except json.JSONDecodeError:
+            return None
+        ts = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S,%f').timestamp()
+        return ts, request_data, None, None
+    return None
+
+
+def iter_capture(path):
+    """逐行读取抓包文件，内存占用与文件大小无关"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parsed = parse_capture_line(line)
+            if parsed is not None:
+                yield parsed
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，相对误差约 2%，内存占用固定"""
+
+    BASE = 1.02
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        micros = max(seconds * 1_000_000, 1.0)
+        self.buckets[int(math.log(micros, self.BASE))] += 1
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.BASE ** (bucket + 1) / 1_000_000, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p90_ms': round(self.percentile(90) * 1000, 2),
+            'p99_ms': round(self.percentile(99) * 1000, 2),
+            'max_ms': round(self.max * 1000, 2)
+        }
+
+
+class ReplayResults:
+    """回放结果汇总，逐条结果可选写入输出文件而不在内存中保留"""
+
+    def __init__(self, output=None):
+        self.output = output
+        self.statuses = Counter()
+        self.paths = Counter()
+        self.mismatches = Counter()
+        self.errors = Counter()
+        self.ttfb = LatencyHistogram()
+        self.latency = LatencyHistogram()
+        self.max_lag = 0.0
+
+    def record(self, result):
+        if result.get('error'):
+            self.errors[result['error']] += 1
+        else:
+            self.statuses[result['status']] += 1
+            self.paths[result['path']] += 1
+            self.ttfb.add(result['ttfb'])
+            self.latency.add(result['latency'])
+        expected = result.get('expected_path')
+        if expected and expected != result.get('path'):
+            self.mismatches[f"{expected}->{result.get('path')}"] += 1
+        if self.output is not None:
+            self.output.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    def summary(self):
+        return {
+            'statuses': dict(self.statuses),
+            'paths': dict(self.paths),
+            'path_mismatches': dict(self.mismatches),
+            'errors': dict(self.errors),
+            'ttfb': self.ttfb.summary(),
+            'latency': self.latency.summary(),
+            'max_schedule_lag_ms': round(self.max_lag * 1000, 2)
+        }
+
+
+async def send_request(session, url, index, request_data, expected_path, tenant, results, semaphore):
+    """发送一个请求并读取完整响应（流式响应逐块读取），抓包记录了租户时发往同一租户"""
+    result = {'index': index, 'model': request_data.get('model'), 'stream': bool(request_data.get('stream')),
+              'expected_path': expected_path}
+    if tenant is not None:
+        result['tenant'] = tenant
+    headers = {TENANT_HEADER: tenant} if tenant is not None else None
+    start = time.perf_counter()
+    try:
+        async with session.post(url, json=request_data, headers=headers) as response:
+            result['ttfb'] = time.perf_counter() - start
+            result['status'] = response.status
+            result['path'] = response.headers.get('X-Mock-Path')
+            async for _ in response.content.iter_any():
+                pass
+            result['latency'] = time.perf_counter() - start
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        result['error'] = type(e).__name__
+        result['latency'] = time.perf_counter() - start
+    finally:
+        semaphore.release()
+    results.record(result)
+
+
+async def replay(args, results):
+    """按原始到达间隔（除以 speed）回放抓包中的请求"""
+    url = args.url.rstrip('/') + '/v1/chat/completions'
+    semaphore = asyncio.Semaphore(args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    # 标记回放请求，服务端开启 capture 时不会把回放请求再次写入抓包文件
+    headers = {'Authorization': f'Bearer {args.api_key}', REPLAY_HEADER: '1'}
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+        start = loop.time()
+        first_ts = None
+        for index, (ts, request_data, expected_path, tenant) in enumerate(iter_capture(args.capture)):
+            if args.limit and index >= args.limit:
+                break
+            due = None
+            if ts is not None and args.speed > 0:
+                if first_ts is None:
+                    first_ts = ts
+                due = start + (ts - first_ts) / args.speed
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # 并发数达到上限时等待，避免无限制地积压请求
+            await semaphore.acquire()
+            # 等待并发名额的时间同样计入调度延迟
+            if due is not None:
+                results.max_lag = max(results.max_lag, loop.time() - due)
+            task = asyncio.create_task(
+                send_request(session, url, index, request_data, expected_path, tenant, results, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay captured chat completion requests against the mock server')
+    parser.add_argument('capture', help='JSONL capture file or app.py log file')
+    parser.add_argument('--url', default='http://localhost:5001', help='Server base URL (default: http://localhost:5001)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Time-warp factor for inter-arrival gaps, e.g. 2 or 10; 0 sends as fast as possible (default: 1)')
+    parser.add_argument('--concurrency', type=int, default=100, help='Maximum in-flight requests (default: 100)')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds (default: 120)')
+    parser.add_argument('--limit', type=int, default=0, help='Replay at most N requests (default: all)')
+    parser.add_argument('--api-key', default='test_key', help='Bearer key sent with each request (default: test_key)')
+    parser.add_argument('--output', help='Write per-request results as JSONL to this file')
+    args = parser.parse_args()
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    results = ReplayResults(output)
+    started = time.perf_counter()
+    try:
+        asyncio.run(replay(args, results))
+    except KeyboardInterrupt:
+        print('Interrupted, partial results:', file=sys.stderr)
+    finally:
+        if output is not None:
+            output.close()
+
+    summary = results.summary()
+    summary['elapsed_s'] = round(time.perf_counter() - started, 2)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if summary['path_mismatches']:
+        sys.exit(1)
@@ -0,0 +1,47 @@
+import json
+import requests
+
+# 测试参数
+base_url = "http://localhost:5002"
+url = f"{base_url}/v1/chat/completions"
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer test_key"
+}
+
+# 上限取自 config.json 的 max_body_bytes，可先调小（例如 1000）以加快测试
+limit = requests.get(f"{base_url}/api/config").json().get("max_body_bytes", 32 * 1024 * 1024)
+
+
+def make_body(size):
+    """构造恰好 size 字节的合法请求体"""
+    template = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": ""}]}
+    padding = size - len(json.dumps(template).encode("utf-8"))
+    template["messages"][0]["content"] = "a" * padding
+    body = json.dumps(template).encode("utf-8")
+    assert len(body) == size
+    return body
+
+
+def chunked(body, chunk_size=65536):
+    """以生成器作为请求体时 requests 使用分块编码，不发送 Content-Length"""
+    for i in range(0, len(body), chunk_size):
+        yield body[i:i + chunk_size]
+
+
+print(f"=== 测试请求体大小上限（{limit} 字节）===")
+
+cases = [
+    ("Content-Length 恰好等于上限", lambda: make_body(limit), 200),
+    ("Content-Length 超过上限", lambda: make_body(limit + 1), 413),
+    ("分块编码恰好等于上限", lambda: chunked(make_body(limit)), 200),
+    ("分块编码超过上限", lambda: chunked(make_body(limit + 1)), 413),
+    ("无效的 JSON", lambda: b'{"model": ', 400),
+]
+
+for name, body, expected_status in cases:
+    response = requests.post(url, headers=headers, data=body(), timeout=60)
+    if response.status_code == expected_status:
+        print(f"✅ {name}: {response.status_code}")
+    else:
+        print(f"❌ {name}: 期望 {expected_status}，实际 {response.status_code} {response.text[:200]}")
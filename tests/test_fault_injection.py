@@ -0,0 +1,51 @@
+import requests
+from collections import Counter
+
+# 测试参数
+base_url = "http://localhost:5002"
+url = f"{base_url}/v1/chat/completions"
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer test_key"
+}
+
+# 需要先在 config.json 的 mock_config.fault_injection 中开启故障注入
+total = 50
+
+print("=== 测试故障注入 ===")
+requests.delete(f"{base_url}/api/stats")
+
+observed = Counter()
+for i in range(total):
+    stream = i % 2 == 0
+    payload = {
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": "Hello"}],
+        "stream": stream
+    }
+    try:
+        response = requests.post(url, headers=headers, json=payload, stream=stream, timeout=30)
+        if response.status_code != 200:
+            observed[f"error_{response.status_code}"] += 1
+        elif stream:
+            body = response.content
+            if b"chatcmpl-malformed" in body:
+                observed["malformed"] += 1
+            if not body.endswith(b"data: [DONE]\n\n"):
+                observed["truncate"] += 1
+    except requests.exceptions.ChunkedEncodingError:
+        observed["reset"] += 1
+    except requests.exceptions.ConnectionError:
+        observed["reset"] += 1
+
+injected = requests.get(f"{base_url}/api/stats").json().get("faults", {})
+
+print(f"\n共发送 {total} 个请求")
+print(f"客户端观察到的故障: {dict(observed)}")
+print(f"服务端注入的故障: {injected}")
+
+for name in ("error_429", "error_500", "error_503", "reset", "malformed", "truncate"):
+    if observed.get(name, 0) == injected.get(name, 0):
+        print(f"✅ {name}: {observed.get(name, 0)}")
+    else:
+        print(f"❌ {name}: 观察到 {observed.get(name, 0)}，注入 {injected.get(name, 0)}")
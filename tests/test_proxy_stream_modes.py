@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import tempfile
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+# 测试参数：第二部分以 localhost:5002 上运行的 mock 服务作为上游，在进程内启动代理
+upstream_url = "http://localhost:5002/v1/chat/completions"
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer test_key"
+}
+
+
+def check(name, passed, detail=""):
+    print(f"{'✅' if passed else '❌'} {name}: {detail}")
+
+
+def chunk(delta=None, finish_reason=None, **fields):
+    data = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 1, "model": "gpt-test", **fields}
+    data.setdefault("choices", [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}])
+    return data
+
+
+class FakeUpstream:
+    """模拟上游流式响应，只提供聚合用到的 iter_lines 和 close"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.closed = False
+
+    def iter_lines(self):
+        yield from self.lines
+
+    def close(self):
+        self.closed = True
+
+
+print("=== 测试流式分块聚合 ===")
+
+# 内容分片、按 index 交错到达的工具调用、只含 usage 的最后一个分块
+usage = {"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+chunks = [
+    chunk({"role": "assistant", "content": ""}),
+    chunk({"content": "Hel"}),
+    chunk({"reasoning_content": "think"}),
+    chunk({"content": "lo"}),
+    chunk({"tool_calls": [{"index": 1, "id": "call_b", "type": "function",
+                           "function": {"name": "second", "arguments": ""}}]}),
+    chunk({"tool_calls": [{"index": 0, "id": "call_a", "type": "function",
+                           "function": {"name": "first", "arguments": '{"a"'}}]}),
+    chunk({"tool_calls": [{"index": 1, "function": {"arguments": '{"b": 2}'}}]}),
+    chunk({"tool_calls": [{"index": 0, "function": {"arguments": ": 1}"}}]}),
+    chunk({}, "tool_calls"),
+    chunk(choices=[], usage=usage),
+]
+aggregator = app.CompletionAggregator()
+for item in chunks:
+    aggregator.add(item)
+result = aggregator.result()
+message = result["choices"][0]["message"]
+check("content 拼接", message["content"] == "Hello", repr(message["content"]))
+check("reasoning_content 拼接", message.get("reasoning_content") == "think", repr(message.get("reasoning_content")))
+calls = [(call["id"], call["function"]["name"], json.loads(call["function"]["arguments"]))
+         for call in message.get("tool_calls", [])]
+check("tool_calls 按 index 合并", calls == [("call_a", "first", {"a": 1}), ("call_b", "second", {"b": 2})], calls)
+check("finish_reason", result["choices"][0]["finish_reason"] == "tool_calls", result["choices"][0]["finish_reason"])
+check("usage 分块", result.get("usage") == usage, result.get("usage"))
+check("响应头字段", (result["id"], result["object"], result["model"]) == ("chatcmpl-test", "chat.completion", "gpt-test"))
+
+with app.app.test_request_context():
+    # data: 之后没有空格的上游
+    lines = [f"data:{json.dumps(item)}".encode() for item in chunks[:4]] + [b"data:[DONE]"]
+    upstream = FakeUpstream(lines)
+    response = app.app.make_response(app.aggregate_stream_response(upstream, log_responses=False))
+    body = response.get_json()
+    check("data: 后无空格", response.status_code == 200 and body["choices"][0]["message"]["content"] == "Hello",
+          f"{response.status_code} {body}")
+    check("聚合后关闭上游响应", upstream.closed)
+
+    # 没有任何分块的流
+    response = app.app.make_response(app.aggregate_stream_response(FakeUpstream([b"data: [DONE]"]), False))
+    check("空流返回 502", response.status_code == 502, response.status_code)
+
+print("\n=== 测试非流式响应转换为流式分块 ===")
+
+completion = {
+    "id": "chatcmpl-test", "object": "chat.completion", "created": 1, "model": "gpt-test",
+    "choices": [{"index": 0, "finish_reason": "tool_calls", "message": {
+        "role": "assistant", "content": None,
+        "tool_calls": [{"id": "call_a", "type": "function", "function": {"name": "first", "arguments": "{}"}}]}}],
+    "usage": usage
+}
+frames = list(app.completion_stream_frames(completion, include_usage=True))
+check("以 [DONE] 结束", frames[-1] == "data: [DONE]\n\n")
+parsed = [json.loads(frame[len("data: "):]) for frame in frames[:-1]]
+check("usage 分块", parsed[-1]["choices"] == [] and parsed[-1]["usage"] == usage)
+aggregator = app.CompletionAggregator()
+for item in parsed:
+    aggregator.add(item)
+roundtrip = aggregator.result()
+check("转换后再聚合与原响应一致",
+      roundtrip["choices"] == completion["choices"] and roundtrip["usage"] == usage, roundtrip["choices"])
+frames = list(app.completion_stream_frames(completion))
+check("未请求 usage 时不输出 usage 分块", not any('"usage"' in frame for frame in frames))
+
+print("\n=== 测试改写上游 stream 参数 ===")
+
+request_data = {"stream": False}
+app.rewrite_upstream_stream(request_data, True, app.ClientStream(False, False))
+check("流式升级请求 usage", request_data == {"stream": True, "stream_options": {"include_usage": True}}, request_data)
+request_data = {"stream": True, "stream_options": {"include_usage": True}}
+app.rewrite_upstream_stream(request_data, False, app.ClientStream(True, True))
+check("非流式上游去掉 stream_options", request_data == {"stream": False}, request_data)
+request_data = {"stream": True}
+app.rewrite_upstream_stream(request_data, True, app.ClientStream(True, False))
+check("客户端本身流式时不改动 stream_options", request_data == {"stream": True}, request_data)
+
+print("\n=== 测试四种代理模式（上游为 localhost:5002 的 mock 服务）===")
+
+try:
+    expected = requests.post(upstream_url, headers=headers, json={
+        "model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hello"}], "stream": False
+    }).json()["choices"][0]["message"]["content"]
+except requests.exceptions.ConnectionError:
+    print("跳过：localhost:5002 上没有运行 mock 服务")
+    sys.exit(0)
+
+config = requests.get("http://localhost:5002/api/config").json()
+config.pop("tenants", None)
+config["mode"] = "proxy"
+config["compression"] = {"enabled": False}
+config["proxy_config"] = {"enabled": True, "target_url": upstream_url, "api_key": "test_key", "model": None,
+                          "log_requests": False, "log_responses": False}
+
+client = app.app.test_client()
+with tempfile.TemporaryDirectory() as workdir:
+    # 代理读取当前目录下的 config.json
+    os.chdir(workdir)
+    for upstream_stream, client_stream, mode in [(None, False, "json"), (None, True, "stream"),
+                                                 (True, False, "stream_to_json"), (False, True, "json_to_stream")]:
+        config["proxy_config"]["upstream_stream"] = upstream_stream
+        with open("config.json", "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        client.delete("/api/stats")
+        response = client.post("/v1/chat/completions", headers=headers, json={
+            "model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hello"}], "stream": client_stream
+        })
+        if client_stream:
+            content = ""
+            for event in response.get_data(as_text=True).split("\n\n"):
+                if event.startswith("data: {"):
+                    content += json.loads(event[len("data: "):])["choices"][0]["delta"].get("content") or ""
+            is_stream = response.mimetype == "text/event-stream"
+        else:
+            content = response.get_json()["choices"][0]["message"]["content"]
+            is_stream = False
+        modes = client.get("/api/stats").get_json().get("proxy_modes", {})
+        check(f"{mode} 模式", response.status_code == 200 and is_stream == client_stream and content == expected
+              and modes == {mode: 1}, f"{response.status_code} {modes} {content!r}")
@@ -0,0 +1,89 @@
+import requests
+import json
+
+# 测试参数
+base_url = "http://localhost:5002"
+url = f"{base_url}/v1/chat/completions"
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer test_key"
+}
+
+# 需要在 mock 模式下运行；测试期间临时写入下面的预设和 default_content，结束后恢复原配置
+model = "template-test"
+message = '说 "hi" \\ 你好\n\ndata: injected'
+escaped_line = message.replace("\r", "\\r").replace("\n", "\\n")
+
+presets = [
+    {
+        "match_conditions": {"model": model, "stream": False},
+        "response": {
+            "id": "chatcmpl-template", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "{{ user }}: {{ last_user_message }} ({{ message_count }})"},
+                "finish_reason": "stop"
+            }]
+        }
+    },
+    {
+        "match_conditions": {"model": model, "stream": True},
+        "stream_response_chunks": [
+            {"id": "chatcmpl-template", "object": "chat.completion.chunk", "created": 0, "model": model,
+             "choices": [{"index": 0, "delta": {"content": "{{ last_user_message }}"}, "finish_reason": None}]},
+            'data: {"id": "chatcmpl-template", "choices": [{"index": 0, "delta": {"content": "{{ model }}"}}]}',
+            "data: plain {{ last_user_message }}"
+        ]
+    }
+]
+
+
+def chat(request_model, stream):
+    payload = {
+        "model": request_model,
+        "user": "tester",
+        "messages": [{"role": "system", "content": "sys"}, {"role": "user", "content": message}],
+        "stream": stream
+    }
+    return requests.post(url, headers=headers, json=payload)
+
+
+def check(name, passed, detail):
+    print(f"{'✅' if passed else '❌'} {name}: {detail}")
+
+
+original = requests.get(f"{base_url}/api/config").json()
+config = json.loads(json.dumps(original))
+config["preset_responses"] = presets + config.get("preset_responses", [])
+config.setdefault("mock_config", {})["default_content"] = "Echo: {{ last_user_message }} via {{ model }}"
+requests.post(f"{base_url}/api/config", json=config)
+
+print("=== 测试响应模板 ===")
+try:
+    # 非流式预设：插入值按 JSON 转义，解析后与原文一致
+    content = chat(model, False).json()["choices"][0]["message"]["content"]
+    check("预设非流式响应", content == f"tester: {message} (2)", repr(content))
+
+    # 默认响应内容模板
+    content = chat("other-model", False).json()["choices"][0]["message"]["content"]
+    check("default_content 模板", content == f"Echo: {message} via other-model", repr(content))
+
+    # 流式预设：JSON 分块解析后与原文一致，非 JSON 文本分块中的换行被转义，不会拆出额外的 SSE 事件
+    events = [event for event in chat(model, True).text.split("\n\n") if event]
+    check("流式分块数量", len(events) == 4, f"{len(events)} 个事件")
+    if len(events) == 4:
+        first = json.loads(events[0][len("data: "):])["choices"][0]["delta"]["content"]
+        check("流式字典分块", first == message, repr(first))
+        second = json.loads(events[1][len("data: "):])["choices"][0]["delta"]["content"]
+        check("流式 JSON 文本分块", second == model, repr(second))
+        check("流式非 JSON 文本分块", events[2] == f"data: plain {escaped_line}", repr(events[2]))
+        check("流式结束标记", events[3] == "data: [DONE]", repr(events[3]))
+
+    # 默认流式响应逐字符输出模板渲染结果
+    text = ""
+    for event in chat("other-model", True).text.split("\n\n"):
+        if event.startswith("data: {"):
+            text += json.loads(event[len("data: "):])["choices"][0]["delta"].get("content") or ""
+    check("default_content 流式响应", text == f"Echo: {message} via other-model", repr(text))
+finally:
+    requests.post(f"{base_url}/api/config", json=original)
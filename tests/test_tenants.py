@@ -0,0 +1,40 @@
+import requests
+
+# 测试参数
+base_url = "http://localhost:5002"
+url = f"{base_url}/v1/chat/completions"
+
+# 需要先在 config.json 中配置 config.example.json 里的 team-a 租户（mode 为 mock）
+payload = {
+    "model": "gpt-3.5-turbo",
+    "messages": [{"role": "user", "content": "Hello"}],
+    "stream": False
+}
+
+
+def ask(headers):
+    response = requests.post(url, headers={"Content-Type": "application/json", **headers}, json=payload, timeout=30)
+    if response.status_code != 200:
+        return response.status_code, response.json()
+    return response.status_code, response.json()["choices"][0]["message"]["content"]
+
+
+print("=== 测试多租户路由 ===")
+requests.delete(f"{base_url}/api/stats")
+
+cases = [
+    ("未绑定租户的 key 使用顶层配置", {"Authorization": "Bearer test_key"}, 200, None),
+    ("按 API key 选择租户", {"Authorization": "Bearer team_a_key"}, 200, "team-a"),
+    ("按请求头选择租户", {"Authorization": "Bearer test_key", "X-Mock-Tenant": "team-a"}, 200, "team-a"),
+    ("租户不存在", {"X-Mock-Tenant": "no-such-tenant"}, 404, None),
+]
+
+for name, headers, expected_status, expected_tenant in cases:
+    status, content = ask(headers)
+    routed = status == 200 and "team-a" in content
+    if status == expected_status and routed == (expected_tenant == "team-a"):
+        print(f"✅ {name}: {status} {content}")
+    else:
+        print(f"❌ {name}: {status} {content}")
+
+print(f"\n租户请求统计: {requests.get(f'{base_url}/api/stats').json().get('tenants', {})}")
@@ -0,0 +1,123 @@
+import re
+import requests
+import json
+
+# 测试参数
+url = "http://localhost:5002/v1/chat/completions"
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer test_key"
+}
+
+tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_weather",
+            "description": "Get the weather for a city.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "city": {"type": "string"},
+                    "unit": {"type": "string", "enum": ["celsius", "fahrenheit"]},
+                    "days": {"type": "integer", "minimum": 1, "maximum": 7},
+                    "ratio": {"type": "number", "exclusiveMinimum": 0, "exclusiveMaximum": 1},
+                    "date": {"type": "string", "format": "date"},
+                    "code": {"type": "string", "pattern": "^[A-Z]{3}-\\d{4}$"},
+                    "step": {"type": "integer", "minimum": 1, "multipleOf": 5},
+                    "level": {"allOf": [{"type": "integer"}, {"minimum": 10}]},
+                    "location": {"$ref": "#/$defs/Location"}
+                },
+                "required": ["city"],
+                "$defs": {
+                    "Location": {
+                        "type": "object",
+                        "properties": {"lat": {"type": "number"}, "lng": {"type": "number"}}
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "current_time",
+            "description": "A tool for getting the current time.",
+            "parameters": {"type": "object", "properties": {}}
+        }
+    }
+]
+
+
+def chat(stream=False, **options):
+    payload = {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": "北京明天天气怎么样"}],
+        "stream": stream,
+        "tools": tools,
+        **options
+    }
+    return requests.post(url, headers=headers, json=payload, stream=stream)
+
+
+def collect_stream_tool_calls(response):
+    """按 index 拼接流式分块中的工具调用"""
+    tool_calls = {}
+    finish_reason = None
+    for line in response.iter_lines():
+        line = line.decode("utf-8")
+        if not line.startswith("data: {"):
+            continue
+        choice = json.loads(line[6:])["choices"][0]
+        finish_reason = choice.get("finish_reason") or finish_reason
+        for delta in choice["delta"].get("tool_calls", []):
+            tool_call = tool_calls.setdefault(delta["index"], {"name": None, "arguments": ""})
+            function = delta.get("function", {})
+            tool_call["name"] = function.get("name") or tool_call["name"]
+            tool_call["arguments"] += function.get("arguments", "")
+    return [tool_calls[index] for index in sorted(tool_calls)], finish_reason
+
+
+def check(name, passed, detail):
+    print(f"{'✅' if passed else '❌'} {name}: {detail}")
+
+
+print("=== 测试按 JSON Schema 生成工具调用参数 ===")
+
+# 参数按 schema 生成，且保留属性顺序
+message = chat(tool_choice="auto").json()["choices"][0]["message"]
+arguments = json.loads(message["tool_calls"][0]["function"]["arguments"])
+check("参数符合 schema",
+      list(arguments) == ["city", "unit", "days", "ratio", "date", "code", "step", "level", "location"]
+      and arguments["unit"] in ("celsius", "fahrenheit")
+      and 1 <= arguments["days"] <= 7
+      and 0 < arguments["ratio"] < 1
+      and re.search(r"^[A-Z]{3}-\d{4}$", arguments["code"])
+      and arguments["step"] >= 1 and arguments["step"] % 5 == 0
+      and isinstance(arguments["level"], int) and arguments["level"] >= 10
+      and set(arguments["location"]) == {"lat", "lng"},
+      arguments)
+
+# 指定调用某个函数
+message = chat(tool_choice={"type": "function", "function": {"name": "current_time"}}).json()["choices"][0]["message"]
+names = [tool_call["function"]["name"] for tool_call in message.get("tool_calls", [])]
+check("tool_choice 指定函数", names == ["current_time"], names)
+
+# tool_choice 为 none 时返回普通内容
+choice = chat(tool_choice="none").json()["choices"][0]
+check("tool_choice 为 none", "tool_calls" not in choice["message"] and choice["finish_reason"] == "stop",
+      choice["message"].get("content"))
+
+# 并行工具调用
+message = chat(tool_choice="auto", parallel_tool_calls=True).json()["choices"][0]["message"]
+names = [tool_call["function"]["name"] for tool_call in message.get("tool_calls", [])]
+check("parallel_tool_calls", names == ["get_weather", "current_time"], names)
+
+# 流式并行工具调用：按 index 拼接后每个调用的参数都是合法 JSON
+tool_calls, finish_reason = collect_stream_tool_calls(chat(stream=True, tool_choice="auto", parallel_tool_calls=True))
+try:
+    parsed = [(tool_call["name"], json.loads(tool_call["arguments"])) for tool_call in tool_calls]
+    check("流式 parallel_tool_calls",
+          [name for name, _ in parsed] == ["get_weather", "current_time"] and finish_reason == "tool_calls", parsed)
+except json.JSONDecodeError as e:
+    check("流式 parallel_tool_calls", False, f"参数不是合法 JSON: {e}")